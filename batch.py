@@ -0,0 +1,171 @@
+#!/usr/bin/env python 
+#-----------------------------------------------------------------------------
+# Author     : Zhigang Liu
+# Date       : Jan 2009
+# Email      : zgliu71@gmail.com
+# License    : General Public License 2 (GPL2) 
+# Description: Slice STL CAD files from the command line
+#-----------------------------------------------------------------------------
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+import os
+import sys
+import time
+import optparse
+import multiprocessing
+from cadmodel import CadModel
+from slicefile import create_writer
+from cache import SliceCache, MeshCache
+
+USAGE = "usage: %prog [options] file.stl ..."
+
+def create_parser():
+    parser = optparse.OptionParser(usage=USAGE)
+    parser.add_option("--height", default="1.0", help="layer height [%default]")
+    parser.add_option("--pitch", default="1.0", help="scanline pitch [%default]")
+    parser.add_option("--speed", default="10", help="scanning speed [%default]")
+    parser.add_option("--fast", default="20", help="fast speed [%default]")
+    parser.add_option("--direction", default="+Z", choices=["+X", "-X", "+Y", "-Y", "+Z", "-Z"],
+                      help="slice direction, one of +X -X +Y -Y +Z -Z [%default]")
+    parser.add_option("--scale", default="1", help="scale factor [%default]")
+    for axis in "xyz":
+        parser.add_option("--rot" + axis, default="0",
+                          help="degrees to rotate around %s before slicing [%%default]" % axis)
+    parser.add_option("-o", "--output-dir", dest="output_dir",
+                      help="directory for the slice files [next to each stl file]")
+    parser.add_option("-f", "--format", default="xml", choices=["xml", "bcs"],
+                      help="slice file format, xml or binary bcs [%default]")
+    parser.add_option("-j", "--jobs", type="int", default=1,
+                      help="number of files sliced at the same time [%default]")
+    parser.add_option("-p", "--processes", type="int", default=1,
+                      help="number of processes slicing the layers of one file [%default]")
+    parser.add_option("--cache-dir", dest="cache_dir",
+                      help="keep parsed meshes and slice results in this directory [no cache]")
+    parser.add_option("--cache-size", dest="cache_size", type="int", default=1024,
+                      help="maximum size of the cache in MB, meshes and slices together [%default]")
+    return parser
+
+def output_name(filename, output_dir, format='xml'):
+    root, ext = os.path.splitext(filename)
+    if output_dir:
+        root = os.path.join(output_dir, os.path.basename(root))
+    return root + '.' + format
+
+def slice_file(args):
+    ''' Open, slice and save one file.
+
+    Returns (filename, message, timings) where message is None on success
+    and timings is a list of (stage, seconds).
+    '''
+    filename, para, output, processes, cache_dir, cache_size = args
+    timings = []
+    cadmodel = CadModel()
+    cadmodel.processes = processes
+    if cache_dir:
+        cadmodel.slice_cache = SliceCache(cache_dir, cache_size << 20)
+        cadmodel.mesh_cache = MeshCache(cache_dir, cache_size << 20)
+
+    writer = None
+    try:
+        start = time.time()
+        ok = cadmodel.open(filename)
+        timings.append(("open", time.time() - start))
+        if not ok:
+            return (filename, "cannot open", timings)
+
+        # the layers are written out as they are sliced
+        start = time.time()
+        writer = create_writer(output)
+        ok = cadmodel.slice(para, writer)
+        timings.append(("slice", time.time() - start))
+        if ok:
+            timings.append(("layers", cadmodel.num_layers))
+            return (filename, None, timings)
+        message = "no layers"
+    except Exception, e:
+        message = str(e) or e.__class__.__name__
+    # no empty or half written file is left behind
+    if writer is not None:
+        writer.abort()
+    return (filename, message, timings)
+
+def report(filename, message, timings):
+    items = []
+    for stage, value in timings:
+        if isinstance(value, float):
+            items.append('%s %.2fs' % (stage, value))
+        else:
+            items.append('%s %s' % (stage, value))
+    if message:
+        items.append('error: ' + message)
+    print '%s: %s' % (filename, ', '.join(items))
+
+def main(argv=None):
+    parser = create_parser()
+    options, filenames = parser.parse_args(argv)
+    if not filenames:
+        parser.error("no stl file given")
+    if options.jobs > 1 and options.processes > 1:
+        parser.error("--jobs and --processes cannot both be above 1")
+
+    para = {"height": options.height, "pitch": options.pitch, "speed": options.speed,
+            "fast": options.fast, "direction": options.direction, "scale": options.scale,
+            "rotx": options.rotx, "roty": options.roty, "rotz": options.rotz}
+    for key in ("height", "pitch", "speed", "fast", "scale"):
+        try:
+            value = float(para[key])
+        except ValueError:
+            parser.error("--%s must be a number" % key)
+        if value <= 0:
+            parser.error("--%s must be > 0" % key)
+    for key in ("rotx", "roty", "rotz"):
+        try:
+            float(para[key])
+        except ValueError:
+            parser.error("--%s must be a number" % key)
+
+    if options.cache_dir and not os.path.isdir(options.cache_dir):
+        os.makedirs(options.cache_dir)
+    tasks = [(filename, para, output_name(filename, options.output_dir, options.format),
+              options.processes, options.cache_dir, options.cache_size)
+             for filename in filenames]
+
+    start = time.time()
+    failed = 0
+    if options.jobs > 1:
+        pool = multiprocessing.Pool(options.jobs)
+        results = pool.imap_unordered(slice_file, tasks)
+    else:
+        pool = None
+        results = map(slice_file, tasks)
+    try:
+        for filename, message, timings in results:
+            report(filename, message, timings)
+            if message:
+                failed += 1
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    print '%d files, %d failed, total %.2fs' % (len(tasks), failed, time.time() - start)
+    if failed:
+        return 1
+    else:
+        return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
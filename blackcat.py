@@ -25,15 +25,11 @@ import wx
 import os
 import sys
 import string
-import copy
-import time
-import logging
-import pprint
-import math
-import random
-import thread
-import Queue
+import traceback
 import cat
+from cadmodel import *
+from cache import SliceCache, MeshCache
+from slicejob import SliceJob
 
 try:
     import psyco
@@ -54,852 +50,8 @@ except ImportError, e:
     print e
     sys.exit()
 
-ERROR = 2
-REDO = 3
-LAYER = 4
-NOT_LAYER = 5
-INTERSECTED = 6
-NOT_INTERSECTED = 7
-SCANLINE = 8
-NOT_SCANLINE = 9
-LIMIT = 1e-8
-
-def equal(f1, f2):
-    if abs(f1 - f2) < LIMIT:
-        return True
-    else:
-        return False
-
-class EndFileException(Exception):
-    def __init__(self, args=None):
-        self.args = args
-
-class FormatError(Exception):
-    def __init__(self, value=None):
-        self.value = value
-    
-    def __str__(self):
-        return 'FormatError:' + self.value
-
-class Point:
-    def __init__(self, x=0.0, y=0.0, z=0.0):
-        self.x = x
-        self.y = y
-        self.z = z
-
-    def __str__(self):
-        s = '(%f, %f, %f) ' % (self.x, self.y, self.z)
-        return s
-
-    def __eq__(self, other):
-        return equal(self.x, other.x) and equal(self.y, other.y) and equal(self.z, other.z)
-
-    def __cmp__(self, other):
-        if self == other:
-            return 0
-        elif self.x < other.x or self.y < other.y or self.z < other.z:
-            return -1
-        else:
-            return 1
-    
-    def __hash__(self):
-        s = '%.6f %.6f %.6f' % (self.x, self.y, self.z)
-        return hash(s)
-
-class Line:
-    def __init__(self, p1=Point(), p2=Point()):
-        self.p1 = p1
-        self.p2 = p2
-
-    def __str__(self):
-        return str(self.p1) + " -> " + str(self.p2)
-
-    def length(self):
-        dx = self.p1.x - self.p2.x
-        dy = self.p1.y - self.p2.y
-        dz = self.p1.z - self.p2.z
-        sum = dx * dx + dy * dy + dz * dz
-        return math.sqrt(sum)
-    
-    def slope(self):
-        diffy = self.p2.y - self.p1.y 
-        diffx = self.p2.x - self.p1.x
-        
-        if equal(diffx, 0.0):
-            return sys.maxint
-        else:
-            k = diffy / diffx
-            return k
-
-def intersect(x1, y1, x2, y2, x):
-    ''' compute y'''
-    y = (y2 - y1) / (x2 - x1) * (x - x1) + y1
-    return y
-
-def is_intersected(p1, p2, z):
-    if (p1.z - z) * (p2.z - z) <= 0.0:
-        return True
-    else:
-        return False
-
-def calc_intersected_point(p1, p2, z):
-    x1 = p1.x
-    y1 = p1.y
-    z1 = p1.z
-
-    x2 = p2.x
-    y2 = p2.y
-    z2 = p2.z
-    
-    x = intersect(z1, x1, z2, x2, z)
-    y = intersect(z1, y1, z2, y2, z)
-    p = Point(x, y, z)
-    return p
-
-class Facet:
-    def __init__(self):
-        self.normal = Point()
-        self.points = (Point(), Point(), Point())
-
-    def __str__(self):
-        s = 'normal: ' + str(self.normal)
-        s += ' points:'
-        for p in self.points:
-            s += str(p)
-        return s
-    
-    def change_direction(self, direction):
-        if direction == "+X":
-            for p in self.points:
-                p.x, p.z = p.z, p.x
-        elif direction == "-X":
-            for p in self.points:
-                p.x, p.z = p.z, -p.x
-        elif direction == "+Y":
-            for p in self.points:
-                p.y, p.z = p.z, p.y
-        elif direction == "-Y":
-            for p in self.points:
-                p.y, p.z = p.z, -p.y
-        elif direction == '-Z':
-            for p in self.points:
-                p.z = -p.z
-        elif direction == '+Z':
-            pass
-        else:
-            assert 0
-
-    def intersect(self, z):
-        L1 = [True for p in self.points if p.z > z]
-        L2 = [True for p in self.points if p.z < z]
-        if len(L1) == 3 or len(L2) == 3:
-            return (NOT_INTERSECTED, None)
-        
-        L1 = []
-        L2 = []
-        for i in range(3):
-            p = self.points[i]
-            if equal(p.z, z):
-                L1.append(i)
-            else:
-                L2.append(i)
-        
-        points = self.points
-        n = len(L1)
-        if n == 0:
-            line = self.intersect_0_vertex(points, z)
-            code = INTERSECTED
-        elif n == 1:
-            i1 = L2[0]
-            i2 = L2[1]
-            p1 = points[i1]
-            p2 = points[i2]
-            if is_intersected(p1, p2, z):
-                line = self.intersect_1_vertex(points[L1[0]], p1, p2, z)
-                code = INTERSECTED
-            else:
-                line = None
-                code = NOT_INTERSECTED
-        elif n == 2 or n == 3:
-            code = REDO
-            line = None
-        
-        return (code, line)
-
-    def intersect_0_vertex(self, points, z):
-        L = []
-        for i in range(3):
-            next = (i + 1) % 3
-            p1 = points[i]
-            p2 = points[next]
-            if is_intersected(p1, p2, z):
-                p = calc_intersected_point(p1, p2, z)
-                L.append(p)
-        
-        assert len(L) == 2
-        return Line(L[0], L[1])
-
-    def intersect_1_vertex(self, p1, p2, p3, z):
-        p = calc_intersected_point(p2, p3, z)
-        return Line(p1, p)
-
-class Layer:
-    colors = ([1, 0, 1], [0, 1, 1], [1, 1, 0], [1, 0, 0], [0, 1, 0], [0, 0, 1], [0, 1, 1])
-
-    def __init__(self, z, pitch):
-        self.lines = []
-        self.z = z
-        self.pitch = pitch
-
-    def empty(self):
-        return len(self.lines) == 0
-
-    def create_gllist(self):
-        self.layerListId = 1001
-        glNewList(self.layerListId, GL_COMPILE)
-        
-        glBegin(GL_LINES)
-        for chunk in self.chunks:
-            r = random.random()
-            g = random.random()
-            b = random.random()
-            glColor(r, g, b)
- 
-            for line in chunk:
-                for p in [line.p1, line.p2]:
-                    glVertex3f(p.x, p.y, p.z)
-        
-        glColor(1, 1, 1)
-        for loop in self.loops:
-            for line in loop:
-                for p in [line.p1, line.p2]:
-                    glVertex3f(p.x, p.y, p.z)
-        
-        glEnd()
-        glEndList()
-        return self.layerListId
-
-    def set_lines(self, lines):
-        self.lines = lines
-        ok = self.createLoops()
-        if not ok:
-            return False
-        
-        self.calc_dimension()             
-        self.create_scanlines()
-        self.create_chunks()
-        return True
-
-    def createLoops(self):
-        lines = self.lines
-
-        self.loops = []
-        while len(lines) != 0:
-            loop = []
-            line = lines.pop()
-            loop.append(line)
-            
-            start = line.p1
-            p2 = line.p2
-            while True:
-                found = False
-                for aline in lines:
-                    if p2 == aline.p1:
-                        p1 = aline.p1
-                        p2 = aline.p2
-                        found = True
-                        break
-                    elif p2 == aline.p2:
-                        p1 = aline.p2
-                        p2 = aline.p1
-                        found = True
-                        break
-
-                if found:        
-                    lines.remove(aline)
-                    loop.append(Line(p1, p2))
-                    if p2 == start:
-                        break
-                else:
-                    print 'error: loop is not found'
-                    return False
-            
-            self.move_lines(loop)
-            nloop = self.merge_lines(loop)
-            self.loops.append(nloop)
-        
-        return True                
-    
-    def move_lines(self, loop):
-        tail = loop[-1]
-        k1 = tail.slope()
-        head = loop[0]
-        k2 = head.slope()
-        rm_list = []
-        if equal(k1, k2):
-            for aline in loop:
-                k = aline.slope()
-                if equal(k, k1):
-                    rm_list.append(aline)
-                else:
-                    break
-            
-            for it in rm_list:
-                loop.remove(it)
-            
-            loop.extend(rm_list)
-        
-        k1 = loop[0].slope()
-        k2 = loop[-1].slope()
-        assert not equal(k1, k2)
-
-    def merge_lines(self, loop):
-        nloop = []
-        while len(loop) != 0:
-            line = loop.pop(0) 
-            k1 = line.slope()
-            p1 = line.p1
-            p2 = line.p2
-            rm_list = []            
-            for aline in loop:
-                k2 = aline.slope()
-                if equal(k1, k2):
-                    p2 = aline.p2
-                    rm_list.append(aline)
-                else:
-                    p2 = aline.p1
-                    break
-            
-            for it in rm_list:
-                loop.remove(it)
-            nloop.append(Line(p1, p2))
-        
-        return nloop
-
-    def calc_dimension(self):
-        ylist = []
-        for loop in self.loops:
-            for line in loop:
-                ylist.append(line.p1.y)
-                ylist.append(line.p2.y)
-        self.miny = min(ylist)                
-        self.maxy = max(ylist)
-    
-    def create_scanlines(self):
-        self.scanlines = []
-        y = self.miny + self.pitch
-        lasty = self.miny
-        while y < self.maxy:
-            code, scanline = self.create_one_scanline(y)
-            
-            if code == SCANLINE:
-                self.scanlines.append(scanline)
-                lasty = y
-                y += self.pitch
-            elif code  == REDO:
-                y = y - self.pitch * 0.01                
-                if y < lasty:
-                    break
-                
-                print 'recreate scan line'
-            else:
-                lasty = y
-                y += self.pitch
-    
-    def create_one_scanline(self, y):
-        s = set()
-        for loop in self.loops:
-            for line in loop:
-                code, x = self.intersect(y, line, loop)
-                if code == REDO:
-                    return (REDO, None)
-                elif code == INTERSECTED:
-                    s.add('%.6f' % x)
-        
-        xlist = map(lambda x: float(x), s)
-        xlist.sort()                    
-
-        n = len(xlist)
-        ok = (n % 2 == 0)
-        if not ok:
-            print 'error: no of points in a scanline is not even', n
-            assert 0
-        
-        # Create lines
-        lines = []
-        for i in range(0, n, 2):
-            x1 = xlist[i]
-            x2 = xlist[i + 1]
-            p1 = Point(x1, y, self.z)
-            p2 = Point(x2, y, self.z)
-            line = Line(p1, p2)
-            lines.append(line)
-        
-        if len(lines) > 0:
-            code = SCANLINE
-        else:
-            code = NOT_SCANLINE
-        return (code, lines)
-
-    def intersect(self, y, line, loop):
-        y1 = line.p1.y
-        y2 = line.p2.y
-        if self.is_intersected(y1, y2, y):
-            count = 0
-            if equal(y, y1):
-                count += 1
-                p = line.p1
-
-            if equal(y, y2):
-                count += 1
-                p = line.p2
-            
-            if count == 0:
-                x = self.intersect_0(y, line)
-                code = INTERSECTED
-            elif count == 1:
-                if self.is_peak(y, p, line, loop):
-                    code = NOT_INTERSECTED
-                    x = None
-                else:
-                    code = INTERSECTED
-                    x = p.x
-            elif count == 2:
-                code = REDO
-                x = None
-        else:
-            code = NOT_INTERSECTED 
-            x = None
-        
-        return (code, x)
-
-    def intersect_0(self, y, line):
-        x1 = line.p1.x
-        y1 = line.p1.y
-        x2 = line.p2.x
-        y2 = line.p2.y
-        
-        if equal(x1, x2):
-            x = x1
-            return x
-        else:
-           x = (y -  y1) * (x2 - x1) / (y2 - y1) + x1
-           return x
-    
-    def is_peak(self, y, point, line, loop):
-        L = []
-        for it in loop:
-            if point == it.p1:
-                L.append(it.p2)
-            elif point == it.p2:
-                L.append(it.p1)
-        
-        val = (L[0].y - y) * (L[1].y - y)
-        if val > 0.0:
-            return True
-        else:
-            return False
-
-    def is_intersected(self, y1, y2, y):
-        if (y1 - y) * (y2 - y) <= 0.0:
-            return True
-        else:
-            return False
-    
-    def get_overlap_line(self, line, scanline):
-        y2 = scanline[0].p1.y
-        y1 = line.p1.y
-        
-        # Are they adjacent lines?
-        distance = abs(y2 - y1)
-        if equal(distance, self.pitch) or distance < self.pitch:
-            for aline in scanline:
-                if aline.p1.x >= line.p2.x or aline.p2.x <= line.p1.x:
-                    pass
-                else:
-                    return aline
-        else:
-            return False                
-
-    def create_chunks(self):
-        self.chunks = []
-        scanlines = self.scanlines
-        while len(scanlines) != 0:
-            chunk = []
-            scanline = scanlines[0]
-            line = scanline.pop(0)
-            chunk.append(line)
-            
-            for scanline in scanlines[1:]:
-                nline = self.get_overlap_line(line, scanline)
-                if nline:
-                    chunk.append(nline)
-                    scanline.remove(nline)
-                    line = nline 
-                else:
-                    break
-            
-            self.chunks.append(chunk)
-            scanlines = filter(lambda x: len(x) > 0, scanlines)
-    
-    def write(self, f):
-        print >> f, '<layer id="', self.id, '">'
-        self.writeloop(f)
-        self.writechunks(f)
-        print >> f, '</layer>'
-    
-    def writeloop(self, f):
-        print >> f, '<loops num="', len(self.loops), '">'
-        count = 1
-        for loop in self.loops:
-            print >> f, '<loop id="', count, '">'
-            for line in loop:
-                writeline(line, f)
-            print >> f, '</loop>'                
-            count += 1
-        print >> f, '</loops>'
-
-    def writechunks(self, f):
-        print >> f, '<chunks num="', len(self.chunks), '">'
-        count = 1
-        for chunk in self.chunks:
-            print >> f, '<chunk id="', count, '">'
-            for line in chunk:
-                writeline(line, f)
-            print >> f, '</chunk>'
-            count += 1
-        print >> f, '</chunks>'
-
-def writeline(line, f):
-    print >> f, '<line>'
-    for p in (line.p1, line.p2):
-        print >> f, '<point>',
-        print >> f, '<x>', p.x, '</x>',
-        print >> f, '<y>', p.y, '</y>',
-        print >> f, '<z>', p.z, '</z>',
-        print >> f, '</point>'
-    print >> f, '</line>'        
-
-class CadModel:
-    def __init__(self):
-        self.init_logger()
-        self.loaded = False
-        self.curr_layer = -1
-        self.sliced = False
-        self.dimension = {}
-    
-    def next_layer(self):
-        n = len(self.layers)
-        self.curr_layer = (self.curr_layer + 1) % len(self.layers)
-    
-    def prev_layer(self):
-        n = len(self.layers)
-        self.curr_layer -= 1
-        if self.curr_layer == -1:
-            self.curr_layer = len(self.layers) -1
-
-    def get_curr_layer(self):
-        return self.layers[self.curr_layer]
-
-    def init_logger(self):
-        #self.logger = logging.getLogger(self.__class__.__name__)
-        self.logger = logging.getLogger("cadmodel")
-        self.logger.setLevel(logging.DEBUG)
-        h = logging.StreamHandler()
-        h.setLevel(logging.DEBUG)
-        f = logging.Formatter("%(levelname)s %(filename)s:%(lineno)d %(message)s")
-        h.setFormatter(f)
-        self.logger.addHandler(h)
-    
-    def get_line(self, f):
-        line = f.readline()
-        if not line:
-            raise EndFileException, 'end of file'
-        return line.strip()
-
-    def get_normal(self, f):
-        line = self.get_line(f)
-        items = line.split()
-        num_items = len(items)
-        if num_items != 5:
-            if num_items >=1 and items[0] == "endsolid":
-                self.loaded = True
-                raise EndFileException, 'endfile'
-            else:
-                self.logger.error(line)
-                raise FormatError, line
-        
-        if items[0] != 'facet' and items[1] != 'normal':
-            self.logger.error(line)
-            raise FormatError, line
-        
-        L = map(lambda x: float(x), items[2:])
-        normal = Point(L[0], L[1], L[2])
-        return normal
-
-    def get_outer_loop(self, f):
-        line = self.get_line(f)
-        if line != "outer loop":
-            self.logger.error(line)
-            raise FormatError, line
-
-    def get_vertex(self, f):
-        points = []
-        for i in range(3):
-            line = self.get_line(f)
-            items = line.split()
-            no = len(items)
-            if no != 4:
-                self.logger.error(line)
-                raise FormatError, line
-            if items[0] != 'vertex':
-                self.logger.error(line)
-                raise FormatError, line
-
-            L = map(lambda x: float(x), items[1:])
-            point = Point(L[0], L[1], L[2])
-            points.append(point)
-        return points
-    
-    def get_end_loop(self, f):
-        line = self.get_line(f) 
-        if line != 'endloop':
-            self.logger.error(line)
-            raise FormatError, line
-    
-    def get_end_facet(self, f):
-        line = self.get_line(f)
-        if line != 'endfacet':
-            self.logger.error(line)
-            raise FormatError, line
-
-    def get_facet(self, f):
-        normal = self.get_normal(f)   
-        self.get_outer_loop(f)
-        points = self.get_vertex(f)
-        facet = Facet()
-        facet.normal = normal
-        facet.points = points
-        self.get_end_loop(f)
-        self.get_end_facet(f)
-        return facet
-    
-    def get_solid_line(self, f):
-        ''' Read the first line'''
-        line = self.get_line(f)
-        items = line.split()
-        no = len(items)
-        if no >= 2 and items[0] == 'solid':
-            self.modelName = items[1]
-        else:
-            self.logger.error(line)
-            raise FormatError, line
-    
-    def calc_dimension(self):
-        if self.loaded:
-            xlist = []
-            ylist = []
-            zlist = []
-            for facet in self.facets:
-                for p in facet.points:
-                    xlist.append(p.x)
-                    ylist.append(p.y)
-                    zlist.append(p.z)
-            self.minx = min(xlist)
-            self.maxx = max(xlist)
-            self.miny = min(ylist)
-            self.maxy = max(ylist)
-            self.minz = min(zlist)
-            self.maxz = max(zlist)
-            
-            self.xsize = self.maxx - self.minx
-            self.ysize = self.maxy - self.miny
-            self.zsize = self.maxz - self.minz
-
-            self.diameter = math.sqrt(self.xsize * self.xsize + self.ysize * self.ysize + self.zsize * self.zsize)
-
-            # Center
-            self.xcenter = (self.minx + self.maxx) / 2
-            self.ycenter = (self.miny + self.maxy) / 2
-            self.zcenter = (self.minz + self.maxz) / 2
-
-    def open(self, filename):
-        start = time.time()
-        try:
-            f = open(filename) 
-        except IOError, e:
-            print e
-            return False
-        
-        try:
-            self.get_solid_line(f)
-            self.facets = [] 
-            while True:
-                facet = self.get_facet(f)
-                self.facets.append(facet)
-        except EndFileException, e:
-            pass
-        except FormatError, e:
-            print e
-            return False
-        
-        if self.loaded:
-            self.calc_dimension()
-            self.logger.debug("no of facets:" + str(len(self.facets)))
-            self.oldfacets = copy.deepcopy(self.facets)
-            self.sliced = False
-            self.set_old_dimension()
-            cpu = '%.1f' % (time.time() - start)
-            
-            print 'open cpu', cpu, 'secs'
-            return True
-        else:
-            return False
-    
-    def save(self, filename):
-        f = open(filename, 'w')
-        print >> f, '<slice>'
-        print >> f, '    <dimension>'
-        print >> f, '        <x>', self.xsize, '</x>'
-        print >> f, '        <y>', self.ysize, '</y>'
-        print >> f, '        <z>', self.zsize, '</z>'
-        print >> f, '    </dimension>'
-        print >> f, '    <para>'
-        print >> f, '         <layerheight>', self.height, '</layerheight>'
-        print >> f, '         <layerpitch>', self.pitch, '</layerpitch>'
-        print >> f, '         <speed>', self.speed, '</speed>'
-        print >> f, '    </para>'
-        print >> f, '<layers num="', len(self.layers), '">'
-
-        for layer in self.layers:
-            layer.write(f)
-        print >> f, '</layers>'
-        print >> f, '</slice>'
-
-    def slice(self, para):
-        self.sliced = False
-        self.height = float(para["height"])
-        self.pitch = float(para["pitch"])
-        self.speed = float(para["speed"])
-        self.fast = float(para["fast"])
-        self.direction = para["direction"]
-        self.scale = float(para["scale"])
-        
-        self.scale_model(self.scale)
-        self.change_direction(self.direction)
-        self.calc_dimension()
-        self.create_layers()
-        self.set_new_dimension()
-        if len(self.layers) > 0:
-            self.sliced = True
-            self.curr_layer = 0
-            return True
-        else:
-            self.sliced = False
-            return False
-    
-    def set_old_dimension(self):
-        self.dimension["oldx"] = str(self.xsize)
-        self.dimension["oldy"] = str(self.ysize)
-        self.dimension["oldz"] = str(self.zsize)
-        self.dimension["newx"] = ""
-        self.dimension["newy"] = ""
-        self.dimension["newz"] = ""
-
-    def set_new_dimension(self):
-        self.dimension["newx"] = str(self.xsize)
-        self.dimension["newy"] = str(self.ysize)
-        self.dimension["newz"] = str(self.zsize)
-
-    def scale_model(self, factor):
-        self.facets = []
-        for facet in self.oldfacets:
-            nfacet = copy.deepcopy(facet)
-            for p in nfacet.points:
-                p.x *= factor
-                p.y *= factor
-                p.z *= factor
-            self.facets.append(nfacet)
-    
-    def change_direction(self, direction):
-        for facet in self.facets:
-            facet.change_direction(direction)
-    
-    def create_layers(self):
-        start = time.time()
-        self.layers = []
-        z = self.minz + self.height
-        lastz = self.minz
-        count = 0
-
-        no = (self.maxz - self.minz) / self.height
-        no = int(no)
-        self.queue.put(no)
-        while z > self.minz and z <= self.maxz:
-            code, layer = self.create_one_layer(z)
-            
-            if code == LAYER:
-                count += 1
-                layer.id = count
-                self.layers.append(layer)
-                
-                lastz = z
-                z += self.height
-                self.queue.put(count)
-                print 'layer', count, '/', no
-            elif code == ERROR:
-                break
-            elif code == REDO:
-                z = z - self.height * 0.01
-                if z < lastz:
-                    break
-                print 'recreate layer'
-            elif code == NOT_LAYER:
-                lastz = z
-                z += self.height
-           
-        self.queue.put("done")                
-        print 'no of layers:', len(self.layers)                
-        cpu = '%.1f' % (time.time() - start)
-        print 'slice cpu', cpu,'secs'
-    
-    def create_one_layer(self, z):
-        layer = Layer(z, self.pitch)
-        lines = []
-        for facet in self.facets:
-            code, line = facet.intersect(z) 
-            if code == REDO:
-                return (REDO, None)
-            elif code == INTERSECTED:
-                lines.append(line)
-        
-        if len(lines) != 0:
-            ok = layer.set_lines(lines)
-            if ok:
-                return (LAYER, layer)
-            else:
-                return (ERROR, None)
-        else:
-            return (NOT_LAYER, None)
-    
-    def create_gl_model_list(self):
-        self.model_list_id = 1000
-        glNewList(self.model_list_id, GL_COMPILE)
-        if self.loaded:
-            glColor(1, 0, 0)
-            glBegin(GL_TRIANGLES)
-            for facet in self.facets:
-                normal = facet.normal
-                glNormal3f(normal.x, normal.y, normal.z)
-                for p in facet.points:
-                    glVertex3f(p.x, p.y, p.z)
-            glEnd()
-        glEndList()
-
-    def create_gl_layer_list(self):
-        assert self.sliced
-        layer = self.get_curr_layer()
-        return layer.create_gllist()
+# needs OpenGL
+import glrender
 
 class PathCanvas(glcanvas.GLCanvas):
     def __init__(self, parent, cadmodel):
@@ -910,6 +62,7 @@ class PathCanvas(glcanvas.GLCanvas):
         self.Bind(wx.EVT_SIZE, self.OnSize)
         self.Bind(wx.EVT_PAINT, self.OnPaint)
         self.cadmodel = cadmodel
+        self.layer_buffers = glrender.LayerBuffers()
 
     def OnEraseBackground(self, event):
         pass
@@ -965,8 +118,7 @@ class PathCanvas(glcanvas.GLCanvas):
             layer = self.cadmodel.get_curr_layer()
             z = layer.z
             glTranslatef(-self.cadmodel.xcenter, -self.cadmodel.ycenter, -z)
-            layer_id = self.cadmodel.create_gl_layer_list()
-            glCallList(layer_id)
+            self.layer_buffers.get(self.cadmodel).draw()
             
 class ModelCanvas(glcanvas.GLCanvas):
 
@@ -979,6 +131,11 @@ class ModelCanvas(glcanvas.GLCanvas):
         self.xangle = 0
         self.yangle = 0
         self.context = glcanvas.GLContext(self)
+        self.layer_buffers = glrender.LayerBuffers()
+        self.model_buffer = None
+        # a coarse model drawn while the mouse turns it
+        self.preview_buffer = None
+        self.dragging = False
 
         self.Bind(wx.EVT_ERASE_BACKGROUND, self.OnEraseBackground)
         self.Bind(wx.EVT_SIZE, self.OnSize)
@@ -1000,8 +157,7 @@ class ModelCanvas(glcanvas.GLCanvas):
     
     def show_path(self):
         if self.cadmodel.sliced:
-            layer_id = self.cadmodel.create_gl_layer_list()
-            glCallList(layer_id)
+            self.layer_buffers.get(self.cadmodel).draw()
 
     def show_model(self):
         if not self.cadmodel.loaded:
@@ -1020,15 +176,33 @@ class ModelCanvas(glcanvas.GLCanvas):
         # Move model to origin
         glTranslatef(-self.cadmodel.xcenter, -self.cadmodel.ycenter, -self.cadmodel.zcenter)
         
-        glCallList(self.cadmodel.model_list_id)
+        buffer = self.model_buffer
+        if self.dragging:
+            preview = self.get_preview_buffer()
+            if preview is not None:
+                buffer = preview
+        if buffer is not None:
+            buffer.draw()
+
+    def get_preview_buffer(self):
+        if self.preview_buffer is None:
+            mesh = self.cadmodel.preview_mesh()
+            if mesh is not None:
+                self.preview_buffer = glrender.create_model_buffer(mesh)
+        return self.preview_buffer
 
     def OnMouseDown(self, evt):
         self.CaptureMouse()
+        self.dragging = True
         self.x, self.y = self.lastx, self.lasty = evt.GetPosition()
 
     def OnMouseUp(self, evt):
         if self.HasCapture():
             self.ReleaseMouse()
+        if self.dragging:
+            # back to the full model
+            self.dragging = False
+            self.Refresh(False)
 
     def OnMouseMotion(self, evt):
         if evt.Dragging() and evt.LeftIsDown():
@@ -1047,7 +221,14 @@ class ModelCanvas(glcanvas.GLCanvas):
         if not self.init:
             self.setup_gl_context()
             self.init =  True
-        self.cadmodel.create_gl_model_list()
+        if self.model_buffer is not None:
+            self.model_buffer.delete()
+            self.model_buffer = None
+        if self.preview_buffer is not None:
+            self.preview_buffer.delete()
+            self.preview_buffer = None
+        if self.cadmodel.loaded:
+            self.model_buffer = glrender.create_model_buffer(self.cadmodel.mesh)
         self.Refresh()
 
     def OnSize(self, event):
@@ -1224,13 +405,23 @@ class ControlPanel(wx.Panel):
 class BlackcatFrame(wx.Frame):
     def __init__(self):
         wx.Frame.__init__(self, None, -1, "Blackcat - STL CAD file slicer", size=(800, 600))
-        self.slice_parameter = {"height":"1.0", "pitch":"1.0", "speed":"10", "fast":"20", "direction":"+Z", "scale":"1"}
+        self.slice_parameter = {"height":"1.0", "pitch":"1.0", "speed":"10", "fast":"20", "direction":"+Z", "scale":"1",
+                                "rotx":"0", "roty":"0", "rotz":"0"}
         self.create_menubar()
         self.create_toolbar()
         self.cadmodel = CadModel()
+        try:
+            cache_dir = os.path.join(os.path.expanduser("~"), ".blackcat", "cache")
+            self.cadmodel.slice_cache = SliceCache(cache_dir)
+            self.cadmodel.mesh_cache = MeshCache(cache_dir)
+        except OSError, e:
+            print e
+        self.slice_job = None
+        self.progress_dialog = None
         self.statusbar = self.CreateStatusBar()
         self.create_panel()
         self.Centre()
+        self.Bind(wx.EVT_CLOSE, self.OnClose)
 
     def create_toolbar(self):
         self.ID_SLICE = 1001
@@ -1321,8 +512,9 @@ class BlackcatFrame(wx.Frame):
 
     def menu_data(self):
         return (("&File", ("&Open\tCtrl+o", "Open CAD file", self.OnOpen, wx.ID_OPEN),
+                          ("Open Slice &File", "Open slice result file", self.OnOpenSlice, -1),
                           ("S&lice\tCtrl+l", "Slice CAD model", self.OnSlice, -1),
-                          ("&Save\tCtrl+s", "Save slice result as xml file", self.OnSave, wx.ID_SAVE),  
+                          ("&Save\tCtrl+s", "Save slice result as xml or binary file", self.OnSave, wx.ID_SAVE),  
                           ("", "", "", ""),
                          ("&Quit\tCtrl+q", "Quit", self.OnQuit, wx.ID_EXIT)),
                 ("Edit", ("Next Layer\tpgdn", "next layer", self.OnNextLayer, -1),
@@ -1334,13 +526,16 @@ class BlackcatFrame(wx.Frame):
         if not self.cadmodel.sliced:
             return
 
-        wildcard = "xml file (*.xml)|*.xml|All files (*.*)|*.*"
-        dlg = wx.FileDialog(None, "Save slice data as xml file", os.getcwd(), self.cadname, wildcard, wx.SAVE)
+        wildcard = "xml file (*.xml)|*.xml|binary slice file (*.bcs)|*.bcs|All files (*.*)|*.*"
+        dlg = wx.FileDialog(None, "Save slice data", os.getcwd(), self.cadname, wildcard, wx.SAVE)
         if dlg.ShowModal() == wx.ID_OK:
             filename = dlg.GetPath()
             root, ext = os.path.splitext(filename)
-            if ext.lower() != '.xml':
-                filename = filename + '.xml'
+            if ext.lower() not in ('.xml', '.bcs'):
+                if dlg.GetFilterIndex() == 1:
+                    filename = filename + '.bcs'
+                else:
+                    filename = filename + '.xml'
             self.cadmodel.save(filename)
             print 'slicing info is saved in', filename
 
@@ -1364,7 +559,15 @@ class BlackcatFrame(wx.Frame):
             self.Bind(wx.EVT_MENU, handler, menu_item)
         return menu
 
+    def is_slicing(self):
+        if self.slice_job is not None and self.slice_job.is_running():
+            wx.MessageBox("slicing in progress", "warning")
+            return True
+        return False
+
     def OnOpen(self, event):
+        if self.is_slicing():
+            return
         wildcard = "CAD std files (*.stl)|*.stl|All files (*.*)|*.*"
         dlg = wx.FileDialog(None, "Open CAD stl file", os.getcwd(), "", wildcard, wx.OPEN)
         if dlg.ShowModal() == wx.ID_OK:
@@ -1372,10 +575,37 @@ class BlackcatFrame(wx.Frame):
             self.statusbar.SetStatusText(path)
             print 'open', path
             ok = self.cadmodel.open(path)
+            if ok:
+                self.cadmodel.start_lods()
+                self.model_canvas.create_model()
+                self.path_canvas.Refresh()
+                self.left_panel.set_dimension(self.cadmodel.dimension)
+                basename = os.path.basename(path)
+                root, ext = os.path.splitext(basename)
+                self.cadname = root
+            else:
+                wx.MessageBox("Cannot open " + path, 'Error')
+        dlg.Destroy()
+
+    def OnOpenSlice(self, event):
+        if self.is_slicing():
+            return
+        wildcard = "slice files (*.xml;*.bcs)|*.xml;*.bcs|All files (*.*)|*.*"
+        dlg = wx.FileDialog(None, "Open slice file", os.getcwd(), "", wildcard, wx.OPEN)
+        if dlg.ShowModal() == wx.ID_OK:
+            path = dlg.GetPath()
+            self.statusbar.SetStatusText(path)
+            print 'open slice', path
+            ok = self.cadmodel.load_slice(path)
             if ok:
                 self.model_canvas.create_model()
                 self.path_canvas.Refresh()
                 self.left_panel.set_dimension(self.cadmodel.dimension)
+                self.left_panel.set_slice_info({"height": str(self.cadmodel.height),
+                                                "pitch": str(self.cadmodel.pitch),
+                                                "speed": str(self.cadmodel.speed)})
+                self.left_panel.set_num_layer(len(self.cadmodel.layers))
+                self.left_panel.set_curr_layer(self.cadmodel.curr_layer + 1)
                 basename = os.path.basename(path)
                 root, ext = os.path.splitext(basename)
                 self.cadname = root
@@ -1384,6 +614,8 @@ class BlackcatFrame(wx.Frame):
         dlg.Destroy()
 
     def OnSlice(self, event):
+        if self.is_slicing():
+            return
         if not self.cadmodel.loaded:
             wx.MessageBox("load a CAD model first", "warning")
             return
@@ -1393,51 +625,82 @@ class BlackcatFrame(wx.Frame):
         if result == wx.ID_OK:
             dlg.get_values()
             print 'slicing...'
-            self.cadmodel.queue = Queue.Queue()
-            thread.start_new_thread(self.cadmodel.slice, (self.slice_parameter,))
-            num_layers = self.cadmodel.queue.get()
-            if num_layers > 0:
-                pdlg = wx.ProgressDialog("Slicing in progress", "Progress", 
-                                         num_layers, 
-                                         style=wx.PD_ELAPSED_TIME|
-                                               wx.PD_REMAINING_TIME|
-                                               wx.PD_AUTO_HIDE|wx.PD_APP_MODAL)
-            
-                while True:
-                    count = self.cadmodel.queue.get()
-                    if count == 'done':
-                        count = num_layers
-                        pdlg.Update(count)
-                        break
-                    else:
-                        pdlg.Update(count)
-                pdlg.Destroy()
-            
-            self.model_canvas.create_model()
-            self.left_panel.set_dimension(self.cadmodel.dimension)
-            self.left_panel.set_slice_info(self.slice_parameter)
-            self.path_canvas.Refresh()
-
-            if self.cadmodel.sliced:
-                self.left_panel.set_num_layer(len(self.cadmodel.layers))
-                self.left_panel.set_curr_layer(self.cadmodel.curr_layer + 1)
-            else:
-                wx.MessageBox("no layers", "Warning")
-
+            self.statusbar.SetStatusText("slicing...")
+            self.slice_job = SliceJob(self.cadmodel, self.slice_parameter, wx.CallAfter,
+                                      on_start=self.OnSliceStart,
+                                      on_layer=self.OnSliceLayer,
+                                      on_done=self.OnSliceDone,
+                                      on_cancel=self.OnSliceCancel,
+                                      on_error=self.OnSliceError).start()
         dlg.Destroy()
 
+    def OnSliceStart(self, num_layers):
+        if num_layers > 0:
+            # not modal, the window keeps drawing while the layers come
+            self.progress_dialog = wx.ProgressDialog("Slicing in progress", "Progress",
+                                                     num_layers, self,
+                                                     style=wx.PD_ELAPSED_TIME|
+                                                           wx.PD_REMAINING_TIME|
+                                                           wx.PD_CAN_ABORT)
+
+    def OnSliceLayer(self, count):
+        dlg = self.progress_dialog
+        if dlg is None:
+            return
+        keep_going = dlg.Update(min(count, dlg.GetRange()))
+        # a (continue, skip) pair in newer wxPython
+        if isinstance(keep_going, tuple):
+            keep_going = keep_going[0]
+        if not keep_going:
+            self.slice_job.cancel()
+
+    def end_slice(self):
+        if self.progress_dialog is not None:
+            self.progress_dialog.Destroy()
+            self.progress_dialog = None
+        self.model_canvas.create_model()
+        self.left_panel.set_dimension(self.cadmodel.dimension)
+        self.path_canvas.Refresh()
+
+    def OnSliceDone(self, ok):
+        self.end_slice()
+        self.statusbar.SetStatusText("")
+        self.left_panel.set_slice_info(self.slice_parameter)
+        if self.cadmodel.sliced:
+            self.left_panel.set_num_layer(len(self.cadmodel.layers))
+            self.left_panel.set_curr_layer(self.cadmodel.curr_layer + 1)
+        else:
+            wx.MessageBox("no layers", "Warning")
+
+    def OnSliceCancel(self):
+        self.end_slice()
+        self.statusbar.SetStatusText("slicing cancelled")
+
+    def OnSliceError(self, exc_info):
+        self.end_slice()
+        self.statusbar.SetStatusText("slicing failed")
+        message = "".join(traceback.format_exception_only(*exc_info[:2]))
+        wx.MessageBox("Slicing failed:\n" + message, "Error")
+
+    def OnClose(self, event):
+        if self.slice_job is not None and self.slice_job.is_running():
+            self.slice_job.cancel()
+            self.slice_job.join()
+        event.Skip()
+
     def OnQuit(self, event):
         self.Close() 
 
 class CharValidator(wx.PyValidator):
-    def __init__(self, data, key):
+    def __init__(self, data, key, positive=True):
         wx.PyValidator.__init__(self)
         self.Bind(wx.EVT_CHAR, self.OnChar)
         self.data = data
         self.key = key
+        self.positive = positive
 
     def Clone(self):
-        return CharValidator(self.data, self.key)
+        return CharValidator(self.data, self.key, self.positive)
     
     def Validate(self, win):
         text_ctrl = self.GetWindow()
@@ -1458,7 +721,7 @@ class CharValidator(wx.PyValidator):
                 text_ctrl.Refresh()
                 return False
             
-            if value <= 0:
+            if self.positive and value <= 0:
                 wx.MessageBox("value <= 0!", "Error")
                 text_ctrl.SetBackgroundColour('pink')
                 text_ctrl.SetFocus()
@@ -1501,7 +764,7 @@ class SlicePanel(wx.Panel):
         outsizer = wx.BoxSizer(wx.VERTICAL)
         sizer = wx.BoxSizer(wx.VERTICAL)
         outsizer.Add(sizer, 0, wx.ALL, 10)
-        box = wx.FlexGridSizer(rows=6, cols=2, hgap=5, vgap=5)
+        box = wx.FlexGridSizer(rows=9, cols=2, hgap=5, vgap=5)
         for label, dvalue, key in labels:
             lbl = wx.StaticText(self, label=label)
             box.Add(lbl, 0, 0)
@@ -1523,6 +786,13 @@ class SlicePanel(wx.Panel):
         box.Add(lbl, 0, 0)
         scale_txt = wx.TextCtrl(self, -1, "1", size=(80, -1), validator=CharValidator(self.data, "scale"))
         box.Add(scale_txt, 0, wx.EXPAND)
+
+        # rotation in degrees before the part is turned to the slice direction
+        for label, key in (("Rotate X", "rotx"), ("Rotate Y", "roty"), ("Rotate Z", "rotz")):
+            lbl = wx.StaticText(self, label=label)
+            box.Add(lbl, 0, 0)
+            txt = wx.TextCtrl(self, -1, "0", size=(80, -1), validator=CharValidator(self.data, key, False))
+            box.Add(txt, 0, wx.EXPAND)
         self.SetSizer(outsizer)
 
     def get_direction(self):
@@ -0,0 +1,286 @@
+#!/usr/bin/env python 
+#-----------------------------------------------------------------------------
+# Author     : Zhigang Liu
+# Date       : Jan 2009
+# Email      : zgliu71@gmail.com
+# License    : General Public License 2 (GPL2) 
+# Description: Keep slice results on disk for reuse
+#-----------------------------------------------------------------------------
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+import os
+import time
+import struct
+import hashlib
+import tempfile
+import numpy
+import slicefile
+from cadmodel import Mesh, FormatError
+
+# change this when the slicing gives different layers, so that old
+# results are not used any more
+VERSION = 2
+# the files of every kind of cache, which share one maxsize in a directory
+CACHE_EXTS = ('.bcs', '.bcmesh')
+# a .tmp file this many seconds old is left by a writer that was killed
+STALE_TMP = 3600
+
+class DiskCache:
+    ''' Files with extension ext in directory dirname. The least
+    recently used cache files in dirname, of this cache or of another
+    one sharing the directory, are removed when they take more than
+    maxsize bytes together.
+    '''
+    ext = ''
+
+    def __init__(self, dirname, maxsize=1 << 30):
+        self.dirname = dirname
+        self.maxsize = maxsize
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+
+    def filename(self, key):
+        return os.path.join(self.dirname, key + self.ext)
+
+    def touch(self, filename):
+        # the mtime tells which file was used last
+        try:
+            os.utime(filename, None)
+        except OSError:
+            pass
+
+    def remove(self, filename):
+        try:
+            os.remove(filename)
+        except OSError:
+            pass
+
+    def evict(self, keep=None):
+        ''' Remove the least recently used files, but not keep, until
+        the rest fit in maxsize'''
+        files = []
+        total = 0
+        now = time.time()
+        for name in os.listdir(self.dirname):
+            filename = os.path.join(self.dirname, name)
+            if name.endswith('.tmp'):
+                try:
+                    if os.stat(filename).st_mtime < now - STALE_TMP:
+                        self.remove(filename)
+                except OSError:
+                    pass
+                continue
+            if not name.endswith(CACHE_EXTS):
+                continue
+            try:
+                st = os.stat(filename)
+            except OSError:
+                continue
+            files.append((st.st_mtime, st.st_size, filename))
+            total += st.st_size
+        files.sort()
+        for mtime, size, filename in files:
+            if total <= self.maxsize:
+                break
+            if filename != keep:
+                self.remove(filename)
+                total -= size
+
+class SliceCache(DiskCache):
+    ''' Slice results in .bcs files named after the mesh, its transform
+    and the slice parameters.'''
+    ext = '.bcs'
+
+    def key(self, mesh, matrix, height, pitch):
+        ''' The key for mesh sliced after it is moved by the 4x4 matrix'''
+        sha = hashlib.sha1()
+        for a in (mesh.vertices, mesh.triangles):
+            sha.update('%s %s ' % (a.dtype.str, a.shape))
+            sha.update(a.tostring())
+        sha.update('%d %r %r %r' % (VERSION, numpy.asarray(matrix).tolist(), height, pitch))
+        return sha.hexdigest()
+
+    def get(self, key):
+        ''' A BinarySliceReader for key, None if it is not in the cache'''
+        filename = self.filename(key)
+        if not os.path.exists(filename):
+            return None
+        try:
+            reader = slicefile.BinarySliceReader(filename)
+        except (IOError, FormatError), e:
+            print e
+            self.remove(filename)
+            return None
+        self.touch(filename)
+        return reader
+
+    def writer(self, key, other=None):
+        ''' A writer that puts the layers in the cache under key, and also
+        passes them on to writer other if there is one. Just other
+        if the cache directory cannot be written'''
+        try:
+            return CacheWriter(self, key, other)
+        except (IOError, OSError), e:
+            print e
+            return other
+
+class CacheWriter:
+    ''' Write the layers to a temporary file in the cache, which only
+    gets its name when all the layers are written.'''
+    def __init__(self, cache, key, other=None):
+        self.cache = cache
+        self.key = key
+        self.other = other
+        fd, self.tmpname = tempfile.mkstemp('.tmp', key, cache.dirname)
+        os.close(fd)
+        try:
+            self.writer = slicefile.BinarySliceWriter(self.tmpname, 'd')
+        except:
+            cache.remove(self.tmpname)
+            raise
+
+    def begin(self, cadmodel, num=None):
+        self.writer.begin(cadmodel)
+        if self.other is not None:
+            self.other.begin(cadmodel, num)
+
+    def write_layer(self, layer):
+        self.writer.write_layer(layer)
+        if self.other is not None:
+            self.other.write_layer(layer)
+
+    def end(self):
+        self.writer.end()
+        filename = self.cache.filename(self.key)
+        try:
+            os.rename(self.tmpname, filename)
+        except OSError:
+            # another process has put the same result there first
+            self.cache.remove(self.tmpname)
+        self.cache.evict(filename)
+        if self.other is not None:
+            self.other.end()
+
+    def abort(self):
+        self.writer.abort()
+        if self.other is not None:
+            self.other.abort()
+
+# Parsed mesh file (.bcmesh), all little endian:
+#   header   MESH_HEADER: magic, version, length of the model name, size,
+#            mtime and sha1 of the stl file, number of vertices and of
+#            triangles, followed by the model name
+#   arrays   vertices (float64), triangles (int32) and normals (float64),
+#            each starting at a multiple of MESH_ALIGN
+MESH_MAGIC = 'BCMESH\0\0'
+MESH_VERSION = 1
+MESH_HEADER = struct.Struct('<8sIIQd20sII')
+MESH_ALIGN = 64
+
+class MeshCache(DiskCache):
+    ''' Parsed stl files in .bcmesh files named after the stl path.
+
+    An entry is used if the stl file has the same size and mtime as
+    when it was put in, or else the same sha1. The arrays are memory
+    mapped, so a hit does not read the mesh at all.
+    '''
+    ext = '.bcmesh'
+
+    def key(self, filename):
+        return hashlib.sha1(os.path.abspath(filename)).hexdigest()
+
+    def get(self, filename):
+        ''' (name, mesh) for the stl file, None if it is not in the cache'''
+        path = self.filename(self.key(filename))
+        if not os.path.exists(path):
+            return None
+        try:
+            st = os.stat(filename)
+            f = open(path, 'r+b')
+            try:
+                data = f.read(MESH_HEADER.size)
+                if len(data) < MESH_HEADER.size:
+                    raise FormatError(path + ': not a mesh file')
+                (magic, version, namelen, size, mtime, digest,
+                 nvertices, ntriangles) = MESH_HEADER.unpack(data)
+                if magic != MESH_MAGIC or version != MESH_VERSION:
+                    raise FormatError(path + ': not a mesh file')
+                name = f.read(namelen)
+                if (size, mtime) != (st.st_size, st.st_mtime):
+                    if size != st.st_size or file_digest(filename) != digest:
+                        return None
+                    # only touched, no need to hash it next time
+                    f.seek(0)
+                    f.write(MESH_HEADER.pack(magic, version, namelen, size, st.st_mtime,
+                                             digest, nvertices, ntriangles))
+            finally:
+                f.close()
+            offset = align(MESH_HEADER.size + namelen)
+            vertices = numpy.memmap(path, '<f8', 'r', offset, (nvertices, 3))
+            offset = align(offset + vertices.nbytes)
+            triangles = numpy.memmap(path, '<i4', 'r', offset, (ntriangles, 3))
+            offset = align(offset + triangles.nbytes)
+            normals = numpy.memmap(path, '<f8', 'r', offset, (ntriangles, 3))
+        except (IOError, OSError, ValueError, FormatError), e:
+            print e
+            self.remove(path)
+            return None
+        self.touch(path)
+        return (name, Mesh(vertices, triangles, normals))
+
+    def put(self, filename, name, mesh, st):
+        ''' Keep the mesh parsed from the stl file, which had os.stat st
+        before it was read'''
+        path = self.filename(self.key(filename))
+        tmpname = None
+        try:
+            digest = file_digest(filename)
+            if os.stat(filename).st_mtime != st.st_mtime:
+                return
+            fd, tmpname = tempfile.mkstemp('.tmp', '', self.dirname)
+            f = os.fdopen(fd, 'wb')
+            try:
+                f.write(MESH_HEADER.pack(MESH_MAGIC, MESH_VERSION, len(name), st.st_size,
+                                         st.st_mtime, digest, len(mesh.vertices), len(mesh)))
+                f.write(name)
+                for a, dtype in ((mesh.vertices, '<f8'), (mesh.triangles, '<i4'), (mesh.normals, '<f8')):
+                    f.write('\0' * (align(f.tell()) - f.tell()))
+                    f.write(numpy.ascontiguousarray(a, dtype).tostring())
+            finally:
+                f.close()
+            os.rename(tmpname, path)
+        except (IOError, OSError), e:
+            print e
+            if tmpname is not None:
+                self.remove(tmpname)
+            return
+        self.evict(path)
+
+def align(offset):
+    return (offset + MESH_ALIGN - 1) // MESH_ALIGN * MESH_ALIGN
+
+def file_digest(filename, blocksize=1 << 20):
+    sha = hashlib.sha1()
+    f = open(filename, 'rb')
+    try:
+        while True:
+            block = f.read(blocksize)
+            if not block:
+                break
+            sha.update(block)
+    finally:
+        f.close()
+    return sha.digest()
@@ -0,0 +1,1483 @@
+#!/usr/bin/env python 
+#-----------------------------------------------------------------------------
+# Author     : Zhigang Liu
+# Date       : Jan 2009
+# Email      : zgliu71@gmail.com
+# License    : General Public License 2 (GPL2) 
+# Description: Slice STL CAD file layer by layer, without any GUI
+#-----------------------------------------------------------------------------
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+import os
+import sys
+import time
+import logging
+import math
+import bisect
+import threading
+import struct
+import ctypes
+import multiprocessing
+from multiprocessing import sharedctypes
+import numpy
+
+ERROR = 2
+LAYER = 4
+NOT_LAYER = 5
+INTERSECTED = 6
+NOT_INTERSECTED = 7
+SCANLINE = 8
+NOT_SCANLINE = 9
+LIMIT = 1e-8
+
+def equal(f1, f2):
+    if abs(f1 - f2) < LIMIT:
+        return True
+    else:
+        return False
+
+class FormatError(Exception):
+    def __init__(self, value=None, lineno=None):
+        self.value = value
+        self.lineno = lineno
+    
+    def __str__(self):
+        if self.lineno is None:
+            return 'FormatError:' + self.value
+        else:
+            return 'FormatError:line %d: %s' % (self.lineno, self.value)
+
+class SliceCancelled(Exception):
+    pass
+
+class Point:
+    def __init__(self, x=0.0, y=0.0, z=0.0):
+        self.x = x
+        self.y = y
+        self.z = z
+
+    def __str__(self):
+        s = '(%f, %f, %f) ' % (self.x, self.y, self.z)
+        return s
+
+    def __eq__(self, other):
+        return equal(self.x, other.x) and equal(self.y, other.y) and equal(self.z, other.z)
+
+    def __cmp__(self, other):
+        if self == other:
+            return 0
+        elif self.x < other.x or self.y < other.y or self.z < other.z:
+            return -1
+        else:
+            return 1
+    
+    def __hash__(self):
+        s = '%.6f %.6f %.6f' % (self.x, self.y, self.z)
+        return hash(s)
+
+class Line:
+    def __init__(self, p1=Point(), p2=Point()):
+        self.p1 = p1
+        self.p2 = p2
+
+    def __str__(self):
+        return str(self.p1) + " -> " + str(self.p2)
+
+    def length(self):
+        dx = self.p1.x - self.p2.x
+        dy = self.p1.y - self.p2.y
+        dz = self.p1.z - self.p2.z
+        sum = dx * dx + dy * dy + dz * dz
+        return math.sqrt(sum)
+    
+    def slope(self):
+        diffy = self.p2.y - self.p1.y 
+        diffx = self.p2.x - self.p1.x
+        
+        if equal(diffx, 0.0):
+            return sys.maxint
+        else:
+            k = diffy / diffx
+            return k
+
+def intersect(x1, y1, x2, y2, x):
+    ''' compute y'''
+    y = (y2 - y1) / (x2 - x1) * (x - x1) + y1
+    return y
+
+def calc_intersected_point(p1, p2, z):
+    # a vertex within LIMIT of the plane is taken as it is, the same for
+    # every facet
+    if equal(p1.z, z):
+        return Point(p1.x, p1.y, z)
+    if equal(p2.z, z):
+        return Point(p2.x, p2.y, z)
+    x1 = p1.x
+    y1 = p1.y
+    z1 = p1.z
+
+    x2 = p2.x
+    y2 = p2.y
+    z2 = p2.z
+    
+    x = intersect(z1, x1, z2, x2, z)
+    y = intersect(z1, y1, z2, y2, z)
+    p = Point(x, y, z)
+    return p
+
+class Facet:
+    def __init__(self):
+        self.normal = Point()
+        self.points = (Point(), Point(), Point())
+
+    def __str__(self):
+        s = 'normal: ' + str(self.normal)
+        s += ' points:'
+        for p in self.points:
+            s += str(p)
+        return s
+    
+    def intersect(self, z):
+        ''' Cut the facet with the plane at z.
+
+        A vertex on the plane, or within LIMIT of it, counts as above it,
+        as if the plane were a little lower, so a facet is cut across two
+        edges or not at all. A facet that only touches the plane at a
+        vertex is not cut.
+        '''
+        points = self.points
+        above = [p.z > z - LIMIT for p in points]
+        if all(above) or not any(above):
+            return (NOT_INTERSECTED, None)
+
+        L = []
+        for i in range(3):
+            next = (i + 1) % 3
+            if above[i] != above[next]:
+                L.append(calc_intersected_point(points[i], points[next], z))
+        if L[0] == L[1]:
+            return (NOT_INTERSECTED, None)
+        return (INTERSECTED, Line(L[0], L[1]))
+
+def intersect_facets(points, z):
+    ''' Intersect (n, 3, 3) facet points with the plane at z in one go.
+
+    Returns (code, segments) where segments is an (m, 2, 3) array holding
+    the same lines, in the same facet order, that Facet.intersect gives,
+    and code is INTERSECTED or NOT_INTERSECTED.
+    '''
+    above = points[:, :, 2] > z - LIMIT
+    count = above.sum(axis=1)
+    ids = numpy.nonzero((count == 1) | (count == 2))[0]
+    p = points[ids]
+    above = above[ids]
+
+    # two of the three edges go from one side to the other
+    crossed = numpy.empty((len(ids), 3), dtype=bool)
+    xy = numpy.empty((len(ids), 3, 2))
+    for i in range(3):
+        j = (i + 1) % 3
+        crossed[:, i] = above[:, i] != above[:, j]
+        xy[:, i] = calc_intersected_points(p[:, i], p[:, j], z)
+    first = crossed.argmax(axis=1)
+    second = 2 - crossed[:, ::-1].argmax(axis=1)
+    rows = numpy.arange(len(ids))
+    segments = numpy.empty((len(ids), 2, 3))
+    segments[:, 0, :2] = xy[rows, first]
+    segments[:, 1, :2] = xy[rows, second]
+    segments[:, :, 2] = z
+
+    # facets touching the plane at a vertex
+    touching = (abs(segments[:, 0] - segments[:, 1]) < LIMIT).all(axis=1)
+    segments = segments[~touching]
+    if len(segments):
+        return (INTERSECTED, segments)
+    else:
+        return (NOT_INTERSECTED, segments)
+
+def calc_intersected_points(p1, p2, z):
+    ''' (n, 2) x, y where the (n, 3) edges p1 -> p2 cross the plane at z'''
+    z1 = p1[:, 2:]
+    z2 = p2[:, 2:]
+    old = numpy.seterr(divide='ignore', invalid='ignore')
+    try:
+        xy = (p2[:, :2] - p1[:, :2]) / (z2 - z1) * (z - z1) + p1[:, :2]
+    finally:
+        numpy.seterr(**old)
+    # a vertex on the plane is taken as it is, as in calc_intersected_point
+    xy = numpy.where(abs(z2 - z) < LIMIT, p2[:, :2], xy)
+    return numpy.where(abs(z1 - z) < LIMIT, p1[:, :2], xy)
+
+def remove_ridges(lines):
+    ''' Drop the lines that come more than once. Two facets give the
+    same line only where their common edge lies on the plane with both
+    of them below it, a ridge that the plane just touches.'''
+    count = {}
+    keys = []
+    for line in lines:
+        p1 = (line.p1.x, line.p1.y)
+        p2 = (line.p2.x, line.p2.y)
+        key = (min(p1, p2), max(p1, p2))
+        keys.append(key)
+        count[key] = count.get(key, 0) + 1
+    return [line for line, key in zip(lines, keys) if count[key] == 1]
+
+def loop_area(loop):
+    ''' Signed area of the polygon of the lines of loop, in x and y'''
+    area = 0.0
+    for line in loop:
+        area += line.p1.x * line.p2.y - line.p2.x * line.p1.y
+    return area / 2
+
+def segments_to_lines(segments):
+    lines = []
+    for p1, p2 in segments.tolist():
+        lines.append(Line(Point(*p1), Point(*p2)))
+    return lines
+
+class Mesh:
+    ''' Indexed triangle mesh.
+
+    vertices is a (n, 3) float array of unique points, triangles a (m, 3)
+    int32 array of vertex indices and normals a (m, 3) float array with one
+    normal per facet. Facet objects are only created on demand.
+    '''
+    def __init__(self, vertices, triangles, normals):
+        self.vertices = vertices
+        self.triangles = triangles
+        self.normals = normals
+        self.facets = None
+        self.points = None
+
+    def __len__(self):
+        return len(self.triangles)
+
+    def facet_points(self, ids=None):
+        ''' (m, 3, 3) array with the coordinates of every facet, or only
+        of the facets with indices ids, which are not kept'''
+        if ids is not None:
+            return self.vertices[self.triangles[ids]]
+        if self.points is None:
+            self.points = self.vertices[self.triangles]
+        return self.points
+
+    def get_facet(self, i):
+        facet = Facet()
+        facet.normal = Point(*self.normals[i].tolist())
+        facet.points = [Point(*p) for p in self.vertices[self.triangles[i]].tolist()]
+        return facet
+
+    def get_facets(self):
+        if self.facets is None:
+            normals = self.normals.tolist()
+            points = self.facet_points().tolist()
+            self.facets = []
+            for normal, (p1, p2, p3) in zip(normals, points):
+                facet = Facet()
+                facet.normal = Point(*normal)
+                facet.points = [Point(*p1), Point(*p2), Point(*p3)]
+                self.facets.append(facet)
+        return self.facets
+
+    def transform(self, matrix):
+        ''' A new mesh with the vertices moved by the 4x4 affine matrix.
+
+        The normals are turned along, the triangles are shared.
+        '''
+        matrix = numpy.asarray(matrix, dtype=numpy.float64)
+        linear = matrix[:3, :3]
+        vertices = numpy.dot(self.vertices, linear.T)
+        vertices += matrix[:3, 3]
+        # -0.0 and 0.0 must stay the same vertex
+        vertices += 0.0
+
+        normals = numpy.dot(self.normals, numpy.linalg.inv(linear))
+        length = numpy.sqrt((normals * normals).sum(axis=1))
+        length[length == 0.0] = 1.0
+        normals /= length[:, numpy.newaxis]
+        return Mesh(vertices, self.triangles, normals)
+
+# the new x, y, z taken from these columns of the vertices, and their signs
+DIRECTIONS = {"+X": ([2, 1, 0], [1, 1, 1]),
+              "-X": ([2, 1, 0], [1, 1, -1]),
+              "+Y": ([0, 2, 1], [1, 1, 1]),
+              "-Y": ([0, 2, 1], [1, 1, -1]),
+              "+Z": ([0, 1, 2], [1, 1, 1]),
+              "-Z": ([0, 1, 2], [1, 1, -1])}
+
+def direction_matrix(direction):
+    ''' 4x4 matrix that turns a mesh so that direction is up'''
+    axes, signs = DIRECTIONS[direction]
+    matrix = numpy.zeros((4, 4))
+    matrix[[0, 1, 2], axes] = signs
+    matrix[3, 3] = 1.0
+    return matrix
+
+def scale_matrix(factor):
+    matrix = numpy.identity(4)
+    matrix[[0, 1, 2], [0, 1, 2]] = factor
+    return matrix
+
+def translation_matrix(dx, dy, dz):
+    matrix = numpy.identity(4)
+    matrix[:3, 3] = (dx, dy, dz)
+    return matrix
+
+def rotation_matrix(axis, angle):
+    ''' 4x4 matrix for a rotation by angle degrees around axis x, y or z'''
+    i, j = {'x': (1, 2), 'y': (2, 0), 'z': (0, 1)}[axis]
+    a = math.radians(angle)
+    c = math.cos(a)
+    s = math.sin(a)
+    # quarter turns should not leave 6e-17 where 0 is meant
+    if angle % 90 == 0:
+        c = round(c)
+        s = round(s)
+    matrix = numpy.identity(4)
+    matrix[i, i] = c
+    matrix[i, j] = -s
+    matrix[j, i] = s
+    matrix[j, j] = c
+    return matrix
+
+# cells along the longest side for each coarse level, coarse to fine
+LOD_CELLS = (16, 48, 128)
+# most facets drawn while the model is being turned
+PREVIEW_FACETS = 50000
+
+def cluster_mesh(mesh, cells):
+    ''' A coarser mesh with the vertices in each of the cubes of a grid of
+    cells along the longest side merged into their mean.
+
+    Triangles that fall to a line or a point are dropped.
+    '''
+    vertices = mesh.vertices
+    low = vertices.min(axis=0)
+    size = (vertices.max(axis=0) - low).max() / cells
+    if size == 0.0:
+        size = 1.0
+    index = numpy.floor((vertices - low) / size).astype(numpy.int64)
+    numpy.clip(index, 0, cells - 1, out=index)
+    keys = (index[:, 0] * cells + index[:, 1]) * cells + index[:, 2]
+    keys, inverse = numpy.unique(keys, return_inverse=True)
+
+    counts = numpy.bincount(inverse).astype(numpy.float64)
+    merged = numpy.empty((len(keys), 3))
+    for axis in range(3):
+        merged[:, axis] = numpy.bincount(inverse, vertices[:, axis]) / counts
+
+    triangles = inverse[mesh.triangles]
+    keep = ((triangles[:, 0] != triangles[:, 1]) &
+            (triangles[:, 1] != triangles[:, 2]) &
+            (triangles[:, 2] != triangles[:, 0]))
+    triangles = triangles[keep].astype(numpy.int32)
+
+    # the facets have turned, the old normal is kept where one fell flat
+    points = merged[triangles]
+    normals = numpy.cross(points[:, 1] - points[:, 0], points[:, 2] - points[:, 0])
+    length = numpy.sqrt((normals * normals).sum(axis=1))
+    flat = length == 0.0
+    length[flat] = 1.0
+    normals /= length[:, numpy.newaxis]
+    normals[flat] = mesh.normals[keep][flat]
+    return Mesh(merged, triangles, normals)
+
+def create_lods(mesh, cells=LOD_CELLS):
+    ''' Coarse versions of mesh, coarse to fine, each with at most
+    half the facets of the next one'''
+    lods = []
+    for n in cells:
+        lod = cluster_mesh(mesh, n)
+        if 2 * len(lod) > len(mesh):
+            break
+        if lods and 2 * len(lods[-1]) > len(lod):
+            lods[-1] = lod
+        else:
+            lods.append(lod)
+    return lods
+
+class FacetSweep:
+    ''' Facet index sorted by lowest z, swept upwards one plane at a time.
+
+    active(z, lowz) returns the sorted indices of the facets that may
+    touch a plane between lowz and z. Planes are asked for in increasing
+    order except that a plane may be retried lower down, never below lowz;
+    facets lying entirely below lowz are dropped from the active set.
+    minz and maxz are the lowest and highest z of each facet, order the
+    facets sorted by minz, worked out here if not given.
+    '''
+    def __init__(self, minz, maxz, order=None):
+        if order is None:
+            order = numpy.argsort(minz, kind='mergesort')
+        self.maxz = maxz
+        self.order = order
+        self.sorted_minz = minz[order]
+        self.next = 0
+        self.ids = numpy.zeros(0, dtype=self.order.dtype)
+
+    def active(self, z, lowz):
+        n = numpy.searchsorted(self.sorted_minz, z + LIMIT, side='right')
+        if n > self.next:
+            self.ids = numpy.concatenate((self.ids, self.order[self.next:n]))
+            self.next = n
+        self.ids = self.ids[self.maxz[self.ids] >= lowz - LIMIT]
+        return numpy.sort(self.ids)
+
+def facet_bounds(mesh):
+    ''' The lowest and the highest z of every facet of mesh'''
+    z = mesh.vertices[:, 2][mesh.triangles]
+    return z.min(axis=1), z.max(axis=1)
+
+STL_BINARY_HEADER = 84
+STL_BINARY_FACET = numpy.dtype([('normal', '<f4', (3,)),
+                                ('points', '<f4', (3, 3)),
+                                ('attribute', '<u2')])
+
+def is_binary_stl(filename):
+    ''' A binary STL is an 80 byte header, a facet count and 50 byte facets'''
+    size = os.path.getsize(filename)
+    if size < STL_BINARY_HEADER:
+        return False
+    f = open(filename, 'rb')
+    try:
+        f.seek(80)
+        count, = struct.unpack('<I', f.read(4))
+    finally:
+        f.close()
+    return size == STL_BINARY_HEADER + count * STL_BINARY_FACET.itemsize
+
+def read_binary_stl(filename):
+    ''' Map the facet records of a binary STL file without copying them'''
+    f = open(filename, 'rb')
+    try:
+        header = f.read(80)
+    finally:
+        f.close()
+    size = os.path.getsize(filename)
+    if size == STL_BINARY_HEADER:
+        records = numpy.zeros(0, dtype=STL_BINARY_FACET)
+    else:
+        records = numpy.memmap(filename, dtype=STL_BINARY_FACET, mode='r', offset=STL_BINARY_HEADER)
+    return header, records
+
+STL_ASCII_FACET = ('facet', 'normal', None, None, None,
+                   'outer', 'loop',
+                   'vertex', None, None, None,
+                   'vertex', None, None, None,
+                   'vertex', None, None, None,
+                   'endloop', 'endfacet')
+STL_ASCII_KEYWORDS = [i for i, w in enumerate(STL_ASCII_FACET) if w]
+STL_ASCII_NUMBERS = [i for i, w in enumerate(STL_ASCII_FACET) if not w]
+
+def parse_ascii_stl(f, blocksize=1 << 22):
+    ''' Parse an ASCII STL file into (name, points, normals).
+
+    The file is split into whitespace separated tokens a large block at a
+    time and every group of 21 tokens is checked and converted as one
+    (n, 21) array. Raises FormatError with the line number of the first
+    bad token.
+    '''
+    line = f.readline()
+    items = line.split()
+    if len(items) < 2 or items[0] != 'solid':
+        raise FormatError(line.strip(), 1)
+    name = items[1]
+
+    nfields = len(STL_ASCII_FACET)
+    keywords = numpy.array([STL_ASCII_FACET[i] for i in STL_ASCII_KEYWORDS])
+    blocks = []
+    tokens = []
+    offset = 0          # index of tokens[0] among all tokens after line 1
+    while True:
+        data = f.read(blocksize)
+        if data and not data[-1].isspace():
+            # Do not cut the last token in two
+            data += f.readline()
+        tokens.extend(data.split())
+
+        nrecords = len(tokens) // nfields
+        if nrecords > 0:
+            records = numpy.array(tokens[:nrecords * nfields]).reshape(nrecords, nfields)
+            bad = (records[:, STL_ASCII_KEYWORDS] != keywords).any(axis=1)
+            if bad.any():
+                nrecords = bad.argmax()
+                if tokens[nrecords * nfields] != 'endsolid':
+                    row = records[nrecords, STL_ASCII_KEYWORDS]
+                    col = STL_ASCII_KEYWORDS[(row != keywords).argmax()]
+                    lineno, line = find_token(f, offset + nrecords * nfields + col)
+                    raise FormatError(line, lineno)
+                records = records[:nrecords]
+
+            numbers = records[:, STL_ASCII_NUMBERS]
+            try:
+                numbers = numbers.astype(numpy.float64)
+            except ValueError:
+                for i, token in enumerate(numbers.flat):
+                    try:
+                        float(token)
+                    except ValueError:
+                        row, col = divmod(i, len(STL_ASCII_NUMBERS))
+                        index = offset + row * nfields + STL_ASCII_NUMBERS[col]
+                        lineno, line = find_token(f, index)
+                        raise FormatError(line, lineno)
+            blocks.append(numbers)
+            del tokens[:nrecords * nfields]
+            offset += nrecords * nfields
+
+        if tokens and tokens[0] == 'endsolid':
+            break
+        elif not data:
+            lineno, line = find_token(f, offset)
+            if not tokens:
+                line = 'endsolid is missing'
+            raise FormatError(line, lineno)
+
+    if blocks:
+        numbers = numpy.concatenate(blocks)
+    else:
+        numbers = numpy.zeros((0, len(STL_ASCII_NUMBERS)))
+    normals = numbers[:, :3]
+    points = numbers[:, 3:].reshape(-1, 3, 3)
+    return name, points, normals
+
+def find_token(f, index):
+    ''' Return (line number, line) holding token index of an ASCII STL body'''
+    f.seek(0)
+    f.readline()
+    lineno = 1
+    count = 0
+    line = ''
+    for line in f:
+        lineno += 1
+        count += len(line.split())
+        if count > index:
+            break
+    return lineno, line.strip()
+
+def create_mesh(points, normals):
+    ''' Build an indexed mesh from (m, 3, 3) facet points and (m, 3) normals'''
+    points = numpy.asarray(points, dtype=numpy.float64).reshape(-1, 3)
+    normals = numpy.asarray(normals, dtype=numpy.float64).reshape(-1, 3)
+    # -0.0 and 0.0 must end up as the same vertex
+    points = points + 0.0
+    if len(points) == 0:
+        vertices = numpy.zeros((0, 3), dtype=numpy.float64)
+        triangles = numpy.zeros((0, 3), dtype=numpy.int32)
+    else:
+        vertices, inverse = numpy.unique(points, axis=0, return_inverse=True)
+        triangles = inverse.astype(numpy.int32).reshape(-1, 3)
+    return Mesh(vertices, triangles, normals)
+
+class EndpointMap:
+    ''' Segment endpoints hashed by quantized position.
+
+    Every endpoint is stored in the cell of size QUANTUM that holds it.
+    A lookup visits every cell within LIMIT of the point, so points that
+    are equal within LIMIT but fall on both sides of a cell border still
+    meet.
+    '''
+    QUANTUM = 1e-6
+
+    def __init__(self, lines):
+        self.lines = lines
+        self.cells = {}
+        for i, line in enumerate(lines):
+            self.cells.setdefault(self.key(line.p1), []).append((i, 0))
+            self.cells.setdefault(self.key(line.p2), []).append((i, 1))
+
+    def key(self, p):
+        q = self.QUANTUM
+        return (int(math.floor(p.x / q)), int(math.floor(p.y / q)), int(math.floor(p.z / q)))
+
+    def keys(self, p):
+        q = self.QUANTUM
+        ranges = []
+        for c in (p.x, p.y, p.z):
+            low = int(math.floor((c - LIMIT) / q))
+            high = int(math.floor((c + LIMIT) / q))
+            ranges.append(range(low, high + 1))
+        return [(i, j, k) for i in ranges[0] for j in ranges[1] for k in ranges[2]]
+
+    def find(self, p, used):
+        ''' (segment, end) of the first unused endpoint equal to p, end
+        being 0 for p1 and 1 for p2, or None'''
+        best = None
+        for key in self.keys(p):
+            for i, end in self.cells.get(key, ()):
+                if used[i] or (best is not None and (i, end) > best):
+                    continue
+                line = self.lines[i]
+                if end == 0:
+                    q = line.p1
+                else:
+                    q = line.p2
+                if p == q:
+                    best = (i, end)
+        return best
+
+class EdgeTable:
+    ''' Active edge table for the scanlines of a layer.
+
+    The loop lines are sorted once by their lowest y. active(y, lowy)
+    adds the lines whose lowest y has been reached and drops the ones
+    lying entirely below lowy, the lowest scanline that can still be
+    asked for, and returns the (loop no, line no) of the active lines.
+    '''
+    def __init__(self, loops):
+        edges = []
+        for n, loop in enumerate(loops):
+            for i, line in enumerate(loop):
+                y1 = line.p1.y
+                y2 = line.p2.y
+                edges.append((min(y1, y2), max(y1, y2), n, i))
+        edges.sort()
+        self.edges = edges
+        self.miny = [edge[0] for edge in edges]
+        self.next = 0
+        self.active_edges = []
+
+    def active(self, y, lowy):
+        n = bisect.bisect_right(self.miny, y + LIMIT)
+        if n > self.next:
+            self.active_edges.extend(self.edges[self.next:n])
+            self.next = n
+        limit = lowy - LIMIT
+        self.active_edges = [edge for edge in self.active_edges if edge[1] >= limit]
+        return [(edge[2], edge[3]) for edge in self.active_edges]
+
+class Layer:
+    colors = ([1, 0, 1], [0, 1, 1], [1, 1, 0], [1, 0, 0], [0, 1, 0], [0, 0, 1], [0, 1, 1])
+
+    def __init__(self, z, pitch):
+        self.lines = []
+        self.z = z
+        self.pitch = pitch
+
+    def empty(self):
+        return len(self.lines) == 0
+
+    def set_lines(self, lines):
+        self.lines = lines
+        ok = self.createLoops()
+        if not ok:
+            return False
+        if not self.loops:
+            # only slivers, the layer is empty
+            return True
+        
+        self.calc_dimension()             
+        self.create_scanlines()
+        self.create_chunks()
+        return True
+
+    def set_pitch(self, pitch):
+        ''' Make the scanlines and chunks again for another pitch'''
+        self.pitch = pitch
+        self.calc_dimension()
+        self.create_scanlines()
+        self.create_chunks()
+
+    def createLoops(self):
+        lines = self.lines
+        endpoints = EndpointMap(lines)
+        used = [False] * len(lines)
+
+        self.loops = []
+        for seed in range(len(lines) - 1, -1, -1):
+            if used[seed]:
+                continue
+            used[seed] = True
+            line = lines[seed]
+            loop = []
+            loop.append(line)
+            
+            # the lines of a loop share their end points, and the last
+            # one ends on the start point itself
+            start = line.p1
+            p1 = line.p2
+            while True:
+                found = endpoints.find(p1, used)
+                if found:        
+                    i, end = found
+                    used[i] = True
+                    aline = lines[i]
+                    if end == 0:
+                        p2 = aline.p2
+                    else:
+                        p2 = aline.p1
+                    if p2 == start:
+                        loop.append(Line(p1, start))
+                        break
+                    loop.append(Line(p1, p2))
+                    p1 = p2
+                else:
+                    print 'error: loop is not found'
+                    return False
+            
+            if equal(loop_area(loop), 0.0) or not self.move_lines(loop):
+                # a sliver left where the plane grazes the model
+                continue
+            nloop = self.merge_lines(loop)
+            self.loops.append(nloop)
+        
+        del lines[:]
+        return True                
+    
+    def move_lines(self, loop):
+        ''' Rotate the loop so that it starts at a corner. False if it
+        has none, all its lines being on one line'''
+        tail = loop[-1]
+        k1 = tail.slope()
+        head = loop[0]
+        k2 = head.slope()
+        rm_list = []
+        if equal(k1, k2):
+            for aline in loop:
+                k = aline.slope()
+                if equal(k, k1):
+                    rm_list.append(aline)
+                else:
+                    break
+            
+            for it in rm_list:
+                loop.remove(it)
+            
+            loop.extend(rm_list)
+        
+        k1 = loop[0].slope()
+        k2 = loop[-1].slope()
+        return not equal(k1, k2)
+
+    def merge_lines(self, loop):
+        nloop = []
+        while len(loop) != 0:
+            line = loop.pop(0) 
+            k1 = line.slope()
+            p1 = line.p1
+            p2 = line.p2
+            rm_list = []            
+            for aline in loop:
+                k2 = aline.slope()
+                if equal(k1, k2):
+                    p2 = aline.p2
+                    rm_list.append(aline)
+                else:
+                    p2 = aline.p1
+                    break
+            
+            for it in rm_list:
+                loop.remove(it)
+            nloop.append(Line(p1, p2))
+        
+        return nloop
+
+    def calc_dimension(self):
+        ylist = []
+        for loop in self.loops:
+            for line in loop:
+                ylist.append(line.p1.y)
+                ylist.append(line.p2.y)
+        self.miny = min(ylist)                
+        self.maxy = max(ylist)
+    
+    def create_scanlines(self):
+        self.scanlines = []
+        edges = EdgeTable(self.loops)
+        y = self.miny + self.pitch
+        lasty = self.miny
+        while y < self.maxy:
+            code, scanline = self.create_one_scanline(y, edges.active(y, lasty))
+            if code == SCANLINE:
+                self.scanlines.append(scanline)
+            lasty = y
+            y += self.pitch
+    
+    def create_one_scanline(self, y, edges=None):
+        ''' Cut the loops at y. edges is a list of (loop no, line no) for
+        the lines that may cross y, all lines if None.'''
+        if edges is None:
+            edges = [(n, i) for n, loop in enumerate(self.loops) for i in range(len(loop))]
+
+        xlist = []
+        for n, i in edges:
+            code, x = self.intersect(y, self.loops[n][i])
+            if code == INTERSECTED:
+                xlist.append(x)
+        
+        xlist.sort()                    
+
+        n = len(xlist)
+        ok = (n % 2 == 0)
+        if not ok:
+            # the loops are not closed at y, better no scanline than
+            # one that fills the outside
+            print 'error: no of points in a scanline is not even', n
+            return (NOT_SCANLINE, [])
+        
+        # Create lines
+        lines = []
+        for i in range(0, n, 2):
+            x1 = xlist[i]
+            x2 = xlist[i + 1]
+            # a vertex touching y from below
+            if equal(x1, x2):
+                continue
+            p1 = Point(x1, y, self.z)
+            p2 = Point(x2, y, self.z)
+            line = Line(p1, p2)
+            lines.append(line)
+        
+        if len(lines) > 0:
+            code = SCANLINE
+        else:
+            code = NOT_SCANLINE
+        return (code, lines)
+
+    def intersect(self, y, line):
+        ''' Cut line at y. Returns (code, x). An end on the scanline, or
+        within LIMIT of it, counts as above it, so every line crossing y is
+        cut exactly once, and a cut at an end gives the x of that end'''
+        p1 = line.p1
+        p2 = line.p2
+        if (p1.y > y - LIMIT) == (p2.y > y - LIMIT):
+            return (NOT_INTERSECTED, None)
+        if equal(p1.y, y):
+            return (INTERSECTED, p1.x)
+        if equal(p2.y, y):
+            return (INTERSECTED, p2.x)
+        return (INTERSECTED, self.intersect_0(y, line))
+
+    def intersect_0(self, y, line):
+        x1 = line.p1.x
+        y1 = line.p1.y
+        x2 = line.p2.x
+        y2 = line.p2.y
+        
+        if equal(x1, x2):
+            x = x1
+            return x
+        else:
+           x = (y -  y1) * (x2 - x1) / (y2 - y1) + x1
+           return x
+    
+    def is_adjacent(self, scanline1, scanline2):
+        distance = abs(scanline2[0].p1.y - scanline1[0].p1.y)
+        return equal(distance, self.pitch) or distance < self.pitch
+
+    def create_chunks(self):
+        ''' Link the lines of consecutive scanlines into chunks.
+
+        One pass down the scanlines. Every open chunk, oldest first, takes
+        the leftmost free line of the next scanline that overlaps its last
+        line. The free lines left over start new chunks. This gives the
+        chunks a greedy chunk-by-chunk walk would give.
+        '''
+        self.chunks = []
+        open_chunks = []
+        last = None
+        for scanline in self.scanlines:
+            if len(scanline) == 0:
+                continue
+            taken = [False] * len(scanline)
+            ends = [line.p2.x for line in scanline]
+            extended = []
+            if last is not None and self.is_adjacent(last, scanline):
+                for chunk in open_chunks:
+                    line = chunk[-1]
+                    k = bisect.bisect_right(ends, line.p1.x)
+                    while k < len(scanline) and scanline[k].p1.x < line.p2.x:
+                        if not taken[k]:
+                            taken[k] = True
+                            chunk.append(scanline[k])
+                            extended.append(chunk)
+                            break
+                        k += 1
+            
+            for k in range(len(scanline)):
+                if not taken[k]:
+                    chunk = [scanline[k]]
+                    self.chunks.append(chunk)
+                    extended.append(chunk)
+            open_chunks = extended
+            last = scanline
+    
+    def write(self, f):
+        f.write('<layer id=" %d ">\n%s%s</layer>\n' % (self.id,
+                format_lines('loop', self.loops), format_lines('chunk', self.chunks)))
+
+XML_POINT = '<point> <x> %s </x> <y> %s </y> <z> %s </z> </point>\n'
+XML_LINE = '<line>\n' + XML_POINT + XML_POINT + '</line>\n'
+
+def format_line(line):
+    p1 = line.p1
+    p2 = line.p2
+    return XML_LINE % (p1.x, p1.y, p1.z, p2.x, p2.y, p2.z)
+
+def format_lines(tag, groups):
+    ''' Format the loops or chunks of a layer as xml in one string'''
+    out = ['<%ss num=" %d ">\n' % (tag, len(groups))]
+    count = 1
+    for lines in groups:
+        out.append('<%s id=" %d ">\n' % (tag, count))
+        out.extend([format_line(line) for line in lines])
+        out.append('</%s>\n' % tag)
+        count += 1
+    out.append('</%ss>\n' % tag)
+    return ''.join(out)
+
+class CadModel:
+    # 'vector' intersects all facets of a layer in one NumPy call,
+    # 'facet' goes through Facet.intersect one facet at a time
+    engines = ('vector', 'facet')
+
+    def __init__(self):
+        self.init_logger()
+        self.engine = 'vector'
+        self.processes = 1
+        self.queue = None
+        # a threading.Event that stops slicing at the next layer once set
+        self.cancelled = None
+        self.writer = None
+        self.keep_layers = True
+        self.slice_cache = None
+        self.mesh_cache = None
+        self.geometry = None
+        self.slice_file = None
+        # coarse versions of oldmesh to draw while the view moves
+        self.lods = []
+        # goes up each time the layers are made again
+        self.generation = 0
+        self.layers = []
+        self.num_layers = 0
+        self.loaded = False
+        self.curr_layer = -1
+        self.sliced = False
+        self.dimension = {}
+    
+    def progress(self, value):
+        ''' Report the number of layers, then each layer done, then "done"
+        through self.queue if there is one'''
+        if self.queue is not None:
+            self.queue.put(value)
+
+    def next_layer(self):
+        n = len(self.layers)
+        self.curr_layer = (self.curr_layer + 1) % len(self.layers)
+    
+    def prev_layer(self):
+        n = len(self.layers)
+        self.curr_layer -= 1
+        if self.curr_layer == -1:
+            self.curr_layer = len(self.layers) -1
+
+    def get_curr_layer(self):
+        return self.layers[self.curr_layer]
+
+    def init_logger(self):
+        #self.logger = logging.getLogger(self.__class__.__name__)
+        self.logger = logging.getLogger("cadmodel")
+        if self.logger.handlers:
+            return
+        self.logger.setLevel(logging.DEBUG)
+        h = logging.StreamHandler()
+        h.setLevel(logging.DEBUG)
+        f = logging.Formatter("%(levelname)s %(filename)s:%(lineno)d %(message)s")
+        h.setFormatter(f)
+        self.logger.addHandler(h)
+    
+    def calc_dimension(self):
+        if self.loaded:
+            vertices = self.mesh.vertices
+            self.minx, self.miny, self.minz = vertices.min(axis=0).tolist()
+            self.maxx, self.maxy, self.maxz = vertices.max(axis=0).tolist()
+            
+            self.xsize = self.maxx - self.minx
+            self.ysize = self.maxy - self.miny
+            self.zsize = self.maxz - self.minz
+
+            self.diameter = math.sqrt(self.xsize * self.xsize + self.ysize * self.ysize + self.zsize * self.zsize)
+
+            # Center
+            self.xcenter = (self.minx + self.maxx) / 2
+            self.ycenter = (self.miny + self.maxy) / 2
+            self.zcenter = (self.minz + self.maxz) / 2
+
+    def open(self, filename):
+        start = time.time()
+        try:
+            binary = is_binary_stl(filename)
+            st = os.stat(filename)
+        except (IOError, OSError), e:
+            print e
+            return False
+
+        self.loaded = False
+        self.lods = []
+        cached = None
+        if self.mesh_cache is not None:
+            cached = self.mesh_cache.get(filename)
+        if cached is not None:
+            self.modelName, self.mesh = cached
+            self.loaded = ok = True
+        elif binary:
+            ok = self.open_binary(filename)
+        else:
+            ok = self.open_ascii(filename)
+        
+        if ok and len(self.mesh) == 0:
+            print 'error: no facets in', filename
+            self.loaded = False
+
+        if self.loaded and cached is None and self.mesh_cache is not None:
+            self.mesh_cache.put(filename, self.modelName, self.mesh, st)
+
+        if self.loaded:
+            self.calc_dimension()
+            self.logger.debug("no of facets:" + str(len(self.mesh)))
+            # the mesh as opened, slice() makes a transformed one
+            self.oldmesh = self.mesh
+            self.geometry = None
+            self.sliced = False
+            self.set_old_dimension()
+            cpu = '%.1f' % (time.time() - start)
+            
+            print 'open cpu', cpu, 'secs'
+            return True
+        else:
+            return False
+
+    def create_lods(self):
+        mesh = self.oldmesh
+        lods = create_lods(mesh)
+        # another model may have been opened meanwhile
+        if mesh is self.oldmesh:
+            self.lods = lods
+
+    def start_lods(self):
+        ''' Build the coarse levels of the opened mesh in the background'''
+        thread = threading.Thread(target=self.create_lods)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def preview_mesh(self, maxfacets=PREVIEW_FACETS):
+        ''' The finest coarse level with at most maxfacets, placed like
+        self.mesh, or None if self.mesh is small enough or no level is ready'''
+        if len(self.mesh) <= maxfacets:
+            return None
+        lods = [lod for lod in self.lods if len(lod) <= maxfacets]
+        if not lods:
+            return None
+        if self.mesh is self.oldmesh:
+            return lods[-1]
+        return lods[-1].transform(self.matrix)
+
+    def open_binary(self, filename):
+        header, records = read_binary_stl(filename)
+        name = header.strip('\0 ')
+        if name.startswith('solid'):
+            name = name[5:].strip()
+        self.modelName = name
+        self.mesh = create_mesh(records['points'], records['normal'])
+        self.loaded = True
+        return True
+
+    def open_ascii(self, filename):
+        try:
+            f = open(filename) 
+        except IOError, e:
+            print e
+            return False
+        
+        try:
+            try:
+                name, points, normals = parse_ascii_stl(f)
+            except FormatError, e:
+                self.logger.error(str(e))
+                return False
+        finally:
+            f.close()
+        
+        self.modelName = name
+        self.mesh = create_mesh(points, normals)
+        self.loaded = True
+        return True
+    
+    def save(self, filename):
+        import slicefile
+        writer = slicefile.create_writer(filename)
+        writer.begin(self, len(self.layers))
+        for layer in self.layers:
+            writer.write_layer(layer)
+        writer.end()
+
+    def load_slice(self, filename):
+        ''' Open a slice file written by save() to browse its layers.
+
+        The layers are only read from the file when they are shown.
+        '''
+        import slicefile
+        try:
+            reader = slicefile.open_slice(filename)
+        except (IOError, FormatError), e:
+            print e
+            return False
+
+        self.set_slice_file(reader)
+        self.loaded = False
+        self.geometry = None
+        self.generation += 1
+        self.layers = reader.layers
+        self.num_layers = len(self.layers)
+        self.sliced = self.num_layers > 0
+        self.curr_layer = 0
+        self.height = reader.height
+        self.pitch = reader.pitch
+        self.speed = reader.speed
+        self.fast = reader.fast
+        self.xsize = reader.xsize
+        self.ysize = reader.ysize
+        self.zsize = reader.zsize
+        self.diameter = math.sqrt(self.xsize * self.xsize + self.ysize * self.ysize + self.zsize * self.zsize)
+
+        # the center is not in the file, take it from the middle layer
+        self.xcenter = self.ycenter = self.zcenter = 0.0
+        if self.sliced:
+            layer = self.layers[self.num_layers // 2]
+            xs = [p.x for loop in layer.loops for line in loop for p in (line.p1, line.p2)]
+            ys = [p.y for loop in layer.loops for line in loop for p in (line.p1, line.p2)]
+            if xs:
+                self.xcenter = (min(xs) + max(xs)) / 2
+                self.ycenter = (min(ys) + max(ys)) / 2
+            self.zcenter = layer.z
+
+        for key in ("oldx", "oldy", "oldz"):
+            self.dimension[key] = ""
+        self.set_new_dimension()
+        return True
+
+    def set_slice_file(self, reader):
+        if self.slice_file is not None:
+            self.slice_file.close()
+        self.slice_file = reader
+
+    def slice(self, para, writer=None):
+        ''' Slice the model with the parameters in para.
+
+        If a writer is given, each layer is handed to writer.write_layer
+        as soon as it is done instead of being kept in self.layers.
+        With a slice_cache, the layers come from the cache when the same
+        mesh was sliced with the same parameters before. If only the pitch
+        or the speeds changed since the last slice, its loops are reused.
+        '''
+        self.sliced = False
+        self.height = float(para["height"])
+        self.pitch = float(para["pitch"])
+        self.speed = float(para["speed"])
+        self.fast = float(para["fast"])
+        self.direction = para["direction"]
+        self.scale = float(para["scale"])
+        self.rotation = [float(para.get(key, 0)) for key in ("rotx", "roty", "rotz")]
+        
+        self.matrix = self.create_matrix()
+        # the loops depend on the mesh, its transform and the layer height,
+        # the scanlines and chunks also on the pitch, nothing on the speeds
+        geometry = (self.oldmesh, self.matrix.tolist(), self.height, self.engine)
+        previous = None
+        if geometry == self.geometry and self.layers:
+            previous = self.layers
+        else:
+            self.mesh = self.oldmesh.transform(self.matrix)
+        self.geometry = None
+        self.calc_dimension()
+
+        self.keep_layers = writer is None
+        if self.slice_cache is not None:
+            key = self.slice_cache.key(self.oldmesh, self.matrix, self.height, self.pitch)
+            cached = self.slice_cache.get(key)
+            if cached is None:
+                writer = self.slice_cache.writer(key, writer)
+            else:
+                self.set_slice_file(cached)
+                if self.keep_layers:
+                    previous = cached.layers
+                else:
+                    import slicefile
+                    previous = slicefile.LayerStream(cached)
+        self.writer = writer
+        try:
+            self.create_layers(previous)
+        except:
+            # no half made slice is left behind
+            self.layers = []
+            self.num_layers = 0
+            raise
+        finally:
+            self.writer = None
+        self.geometry = geometry
+        self.set_new_dimension()
+        self.sliced = len(self.layers) > 0
+        self.curr_layer = 0
+        return self.num_layers > 0
+    
+    def create_matrix(self):
+        ''' The matrix from oldmesh to the mesh to slice: rotated around
+        x, y and z about the center of oldmesh, scaled, then turned so
+        that the slice direction is up'''
+        vertices = self.oldmesh.vertices
+        center = (vertices.min(axis=0) + vertices.max(axis=0)) / 2
+        matrix = scale_matrix(self.scale)
+        if any(self.rotation):
+            rotation = translation_matrix(*(-center))
+            for axis, angle in zip("xyz", self.rotation):
+                rotation = numpy.dot(rotation_matrix(axis, angle), rotation)
+            rotation = numpy.dot(translation_matrix(*center), rotation)
+            matrix = numpy.dot(matrix, rotation)
+        return numpy.dot(direction_matrix(self.direction), matrix)
+
+    def set_old_dimension(self):
+        self.dimension["oldx"] = str(self.xsize)
+        self.dimension["oldy"] = str(self.ysize)
+        self.dimension["oldz"] = str(self.zsize)
+        self.dimension["newx"] = ""
+        self.dimension["newy"] = ""
+        self.dimension["newz"] = ""
+
+    def set_new_dimension(self):
+        self.dimension["newx"] = str(self.xsize)
+        self.dimension["newy"] = str(self.ysize)
+        self.dimension["newz"] = str(self.zsize)
+
+    def get_facets(self):
+        return self.mesh.get_facets()
+
+    def create_layers(self, previous=None):
+        ''' Slice the mesh, or reuse the layers in previous if given.
+        Reused layers of another pitch get new scanlines and chunks.'''
+        start = time.time()
+        self.generation += 1
+        self.layers = []
+        self.num_layers = 0
+
+        if previous is not None:
+            no = len(previous)
+        else:
+            no = (self.maxz - self.minz) / self.height
+            no = int(no)
+        self.progress(no)
+        if self.writer is not None:
+            self.writer.begin(self)
+        try:
+            if previous is not None:
+                for layer in previous:
+                    if layer.pitch != self.pitch:
+                        layer.set_pitch(self.pitch)
+                    self.add_layer(layer, no)
+            elif self.processes > 1:
+                self.create_layers_parallel(no)
+            else:
+                self.create_layers_serial(no)
+        except:
+            if self.writer is not None:
+                self.writer.abort()
+            raise
+        if self.writer is not None:
+            self.writer.end()
+        self.progress("done")                
+        print 'no of layers:', self.num_layers                
+        cpu = '%.1f' % (time.time() - start)
+        print 'slice cpu', cpu,'secs'
+    
+    def plane_heights(self):
+        ''' The z of every plane to cut, minz + k * height for k = 1, 2, ...
+        up to maxz. Each is worked out on its own so that rounding errors
+        do not add up from plane to plane.'''
+        zs = []
+        k = 1
+        z = self.minz + self.height
+        while z > self.minz and z <= self.maxz:
+            zs.append(z)
+            k += 1
+            z = self.minz + k * self.height
+        return zs
+
+    def create_layers_serial(self, no):
+        lastz = self.minz
+        sweep = FacetSweep(*facet_bounds(self.mesh))
+        for z in self.plane_heights():
+            code, layer = self.create_one_layer(z, sweep.active(z, lastz))
+            
+            if code == ERROR:
+                break
+            elif code == LAYER:
+                self.add_layer(layer, no)
+            lastz = z
+
+    def create_layers_parallel(self, no):
+        ''' Slice the planes in a pool of self.processes worker processes.
+
+        The mesh is put in shared memory for the workers, along with the
+        z range of the facets and their order for the sweep, so that the
+        workers only gather the points of the facets near each plane.
+        The planes are cut into contiguous runs, and the layers come back
+        in z order as soon as each run is done, packed in arrays by
+        pack_layer, which are much quicker to send than the lines.
+        '''
+        zs = self.plane_heights()
+        size = max(1, len(zs) // (self.processes * 4))
+        runs = [zs[i:i + size] for i in range(0, len(zs), size)]
+
+        mesh = self.mesh
+        minz, maxz = facet_bounds(mesh)
+        order = numpy.argsort(minz, kind='mergesort')
+        args = (share_array(mesh.vertices), share_array(mesh.triangles),
+                share_array(mesh.normals), share_array(minz), share_array(maxz),
+                share_array(order), self.height, self.pitch, self.engine)
+        pool = multiprocessing.Pool(self.processes, init_slice_worker, args)
+        try:
+            for results in pool.imap(slice_planes, runs):
+                for code, packed in results:
+                    if code == ERROR:
+                        return
+                    elif code == LAYER:
+                        self.add_layer(PackedLayer(self.pitch, *packed), no)
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def add_layer(self, layer, no):
+        ''' Number a new layer, keep it and pass it on to self.writer'''
+        if self.cancelled is not None and self.cancelled.is_set():
+            raise SliceCancelled()
+        self.num_layers += 1
+        layer.id = self.num_layers
+        if self.keep_layers:
+            self.layers.append(layer)
+        if self.writer is not None:
+            self.writer.write_layer(layer)
+        self.progress(layer.id)
+        print 'layer', layer.id, '/', no
+
+    def slice_planes(self, zs, sweep):
+        ''' Slice the planes zs, in increasing order, on their own.
+
+        Returns a (code, layer) pair per plane.
+        '''
+        results = []
+        for z in zs:
+            code, layer = self.create_one_layer(z, sweep.active(z, z - self.height))
+            results.append((code, layer))
+            if code == ERROR:
+                break
+        return results
+
+    def create_one_layer(self, z, ids=None):
+        ''' Intersect the facets with indices ids (all if None) at z'''
+        layer = Layer(z, self.pitch)
+        if self.engine == 'vector':
+            points = self.mesh.facet_points(ids)
+            code, segments = intersect_facets(points, z)
+            lines = segments_to_lines(segments)
+        else:
+            facets = self.mesh.get_facets()
+            if ids is not None:
+                facets = [facets[i] for i in ids]
+            lines = []
+            for facet in facets:
+                code, line = facet.intersect(z) 
+                if code == INTERSECTED:
+                    lines.append(line)
+        lines = remove_ridges(lines)
+        
+        if len(lines) != 0:
+            ok = layer.set_lines(lines)
+            if not ok:
+                return (ERROR, None)
+            elif layer.loops:
+                return (LAYER, layer)
+            else:
+                return (NOT_LAYER, None)
+        else:
+            return (NOT_LAYER, None)
+
+def share_array(a):
+    ''' Copy array a into shared memory for the slice worker processes'''
+    a = numpy.ascontiguousarray(a)
+    raw = sharedctypes.RawArray(ctypes.c_char, max(a.nbytes, 1))
+    numpy.frombuffer(raw, dtype=a.dtype, count=a.size)[:] = a.ravel()
+    return (raw, a.dtype.str, a.shape)
+
+def shared_array(shared):
+    raw, dtype, shape = shared
+    size = int(numpy.prod(shape))
+    return numpy.frombuffer(raw, dtype=dtype, count=size).reshape(shape)
+
+# State of a slice worker process, set up once by init_slice_worker
+worker = None
+
+def init_slice_worker(vertices, triangles, normals, minz, maxz, order, height, pitch, engine):
+    global worker
+    mesh = Mesh(shared_array(vertices), shared_array(triangles), shared_array(normals))
+    worker = CadModel()
+    worker.mesh = mesh
+    worker.height = height
+    worker.pitch = pitch
+    worker.engine = engine
+    worker.sweep = FacetSweep(shared_array(minz), shared_array(maxz), shared_array(order))
+
+def slice_planes(zs):
+    results = []
+    for code, layer in worker.slice_planes(zs, worker.sweep):
+        if code == LAYER:
+            layer = pack_layer(layer)
+        results.append((code, layer))
+    return results
+
+def pack_layer(layer):
+    ''' (z, nloops, counts, coords) for the loops and chunks of layer:
+    the number of lines in each loop and then in each chunk, and an
+    (n, 4) array of the x1, y1, x2, y2 of all the lines'''
+    groups = layer.loops + layer.chunks
+    counts = numpy.array([len(lines) for lines in groups], numpy.int32)
+    coords = numpy.array([(line.p1.x, line.p1.y, line.p2.x, line.p2.y)
+                          for lines in groups for line in lines], float)
+    return (layer.z, len(layer.loops), counts, coords.reshape(-1, 4))
+
+class PackedLayer(Layer):
+    ''' A layer packed by pack_layer. The loops and chunks are only made
+    into lines the first time they are used.'''
+    def __init__(self, pitch, z, nloops, counts, coords):
+        self.z = z
+        self.pitch = pitch
+        self.lines = []
+        self.nloops = nloops
+        self.counts = counts
+        self.coords = coords
+
+    def __getattr__(self, name):
+        if name not in ('loops', 'chunks'):
+            raise AttributeError(name)
+        z = self.z
+        rows = self.coords.tolist()
+        groups = []
+        start = 0
+        for count in self.counts.tolist():
+            groups.append([Line(Point(x1, y1, z), Point(x2, y2, z))
+                           for x1, y1, x2, y2 in rows[start:start + count]])
+            start += count
+        self.loops = groups[:self.nloops]
+        self.chunks = groups[self.nloops:]
+        return self.__dict__[name]
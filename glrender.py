@@ -0,0 +1,157 @@
+#!/usr/bin/env python 
+#-----------------------------------------------------------------------------
+# Author     : Zhigang Liu
+# Date       : Jan 2009
+# Email      : zgliu71@gmail.com
+# License    : General Public License 2 (GPL2) 
+# Description: OpenGL vertex buffers for CAD models and layers
+#-----------------------------------------------------------------------------
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+import ctypes
+import collections
+import numpy
+from OpenGL.GL import *
+
+class ArrayBuffer:
+    ''' Vertices and their normals or colors packed in one float32 array
+    and drawn with a single glDrawArrays.
+
+    The array goes into a vertex buffer object if the GL has them and
+    use_vbo is not False, else it is drawn from memory as vertex arrays.
+    color is used for all vertices when there are no colors.
+    '''
+    def __init__(self, mode, vertices, normals=None, colors=None, color=None, use_vbo=None):
+        self.mode = mode
+        self.color = color
+        self.normals = normals is not None
+        self.colors = colors is not None
+        arrays = [a for a in (vertices, normals, colors) if a is not None]
+        self.data = numpy.hstack([numpy.asarray(a, numpy.float32).reshape(-1, 3) for a in arrays])
+        self.stride = self.data.shape[1] * 4
+        self.count = len(self.data)
+        if use_vbo is None:
+            use_vbo = vbo_supported()
+        self.vbo = None
+        if use_vbo and self.count > 0:
+            self.vbo = glGenBuffers(1)
+            glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
+            glBufferData(GL_ARRAY_BUFFER, self.data.nbytes, self.data, GL_STATIC_DRAW)
+            glBindBuffer(GL_ARRAY_BUFFER, 0)
+            self.data = None
+
+    def pointer(self, offset):
+        if self.vbo is not None:
+            return ctypes.c_void_p(offset)
+        return ctypes.c_void_p(self.data.ctypes.data + offset)
+
+    def draw(self):
+        if self.count == 0:
+            return
+        if self.vbo is not None:
+            glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
+        glEnableClientState(GL_VERTEX_ARRAY)
+        glVertexPointer(3, GL_FLOAT, self.stride, self.pointer(0))
+        offset = 12
+        if self.normals:
+            glEnableClientState(GL_NORMAL_ARRAY)
+            glNormalPointer(GL_FLOAT, self.stride, self.pointer(offset))
+            offset += 12
+        if self.colors:
+            glEnableClientState(GL_COLOR_ARRAY)
+            glColorPointer(3, GL_FLOAT, self.stride, self.pointer(offset))
+        elif self.color is not None:
+            glColor(*self.color)
+        glDrawArrays(self.mode, 0, self.count)
+        glDisableClientState(GL_VERTEX_ARRAY)
+        glDisableClientState(GL_NORMAL_ARRAY)
+        glDisableClientState(GL_COLOR_ARRAY)
+        if self.vbo is not None:
+            glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+    def delete(self):
+        if self.vbo is not None:
+            glDeleteBuffers(1, [self.vbo])
+            self.vbo = None
+        self.data = None
+        self.count = 0
+
+def vbo_supported():
+    return bool(glGenBuffers)
+
+def create_model_buffer(mesh, use_vbo=None):
+    ''' The facets of mesh in red, with their normals'''
+    # gathered in float32 and not through facet_points(), which would
+    # keep a float64 copy of every facet on the mesh
+    vertices = mesh.vertices.astype(numpy.float32)[mesh.triangles.ravel()]
+    normals = numpy.repeat(mesh.normals.astype(numpy.float32), 3, axis=0)
+    return ArrayBuffer(GL_TRIANGLES, vertices, normals, color=(1, 0, 0), use_vbo=use_vbo)
+
+def create_layer_buffer(layer, use_vbo=None):
+    ''' The chunks of layer in the colors of Layer.colors, then the loops
+    in white'''
+    vertices = []
+    colors = []
+    count = 0
+    for chunk in layer.chunks:
+        color = layer.colors[count % len(layer.colors)]
+        count += 1
+        for line in chunk:
+            vertices.append((line.p1.x, line.p1.y, line.p1.z, line.p2.x, line.p2.y, line.p2.z))
+        colors.extend([color] * (2 * len(chunk)))
+    for loop in layer.loops:
+        for line in loop:
+            vertices.append((line.p1.x, line.p1.y, line.p1.z, line.p2.x, line.p2.y, line.p2.z))
+        colors.extend([(1, 1, 1)] * (2 * len(loop)))
+    return ArrayBuffer(GL_LINES, vertices, colors=colors, use_vbo=use_vbo)
+
+class LayerBuffers:
+    ''' The ArrayBuffers of the layers shown in one GL context.
+
+    get() makes the buffer of a layer once and then reuses it until the
+    layers of the model are made again. When the buffers hold more than
+    maxvertices vertices, the least recently shown ones are deleted.
+    '''
+    def __init__(self, maxvertices=4000000, use_vbo=None):
+        self.maxvertices = maxvertices
+        self.use_vbo = use_vbo
+        self.buffers = collections.OrderedDict()
+        self.vertices = 0
+        self.generation = None
+
+    def get(self, cadmodel):
+        ''' The buffer of the current layer of cadmodel'''
+        if cadmodel.generation != self.generation:
+            self.clear()
+            self.generation = cadmodel.generation
+        layer = cadmodel.get_curr_layer()
+        if layer.id in self.buffers:
+            buf = self.buffers.pop(layer.id)
+        else:
+            buf = create_layer_buffer(layer, self.use_vbo)
+            self.vertices += buf.count
+        self.buffers[layer.id] = buf
+        while self.vertices > self.maxvertices and len(self.buffers) > 1:
+            key, old = self.buffers.popitem(last=False)
+            self.vertices -= old.count
+            old.delete()
+        return buf
+
+    def clear(self):
+        for buf in self.buffers.values():
+            buf.delete()
+        self.buffers.clear()
+        self.vertices = 0
@@ -0,0 +1,364 @@
+#!/usr/bin/env python 
+#-----------------------------------------------------------------------------
+# Author     : Zhigang Liu
+# Date       : Jan 2009
+# Email      : zgliu71@gmail.com
+# License    : General Public License 2 (GPL2) 
+# Description: Read and write slice result files
+#-----------------------------------------------------------------------------
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+import os
+import re
+import struct
+import numpy
+from cadmodel import Point, Line, Layer, FormatError
+
+# the number of layers is only known at the end of a streamed slice,
+# so this many characters are kept free for it on the <layers> line
+LAYERS_FIELD = 40
+
+class XmlSliceWriter:
+    ''' Write a slice result as xml, one layer at a time.
+
+    begin() writes the dimension and slice parameters of the model,
+    write_layer() each layer as soon as it is done and end() closes
+    the file. If num is not given to begin(), the number of layers is
+    filled in by end(). abort() removes the unfinished file when slicing
+    fails.
+    '''
+    def __init__(self, filename, bufsize=1 << 16):
+        self.filename = filename
+        self.f = open(filename, 'w', bufsize)
+        self.num = 0
+        self.numpos = None
+
+    def begin(self, cadmodel, num=None):
+        f = self.f
+        f.write('<slice>\n'
+                '    <dimension>\n'
+                '        <x> %s </x>\n'
+                '        <y> %s </y>\n'
+                '        <z> %s </z>\n'
+                '    </dimension>\n'
+                '    <para>\n'
+                '         <layerheight> %s </layerheight>\n'
+                '         <layerpitch> %s </layerpitch>\n'
+                '         <speed> %s </speed>\n'
+                '    </para>\n'
+                % (cadmodel.xsize, cadmodel.ysize, cadmodel.zsize,
+                   cadmodel.height, cadmodel.pitch, cadmodel.speed))
+        if num is None:
+            self.numpos = f.tell()
+            f.write(layers_tag(0).ljust(LAYERS_FIELD) + '\n')
+        else:
+            f.write(layers_tag(num) + '\n')
+
+    def write_layer(self, layer):
+        layer.write(self.f)
+        self.num += 1
+
+    def end(self):
+        f = self.f
+        f.write('</layers>\n</slice>\n')
+        if self.numpos is not None:
+            f.seek(self.numpos)
+            f.write(layers_tag(self.num).ljust(LAYERS_FIELD))
+        f.close()
+
+    def abort(self):
+        remove_unfinished(self.f, self.filename)
+
+def remove_unfinished(f, filename):
+    f.close()
+    try:
+        os.remove(filename)
+    except OSError:
+        pass
+
+def layers_tag(num):
+    return '<layers num=" %d ">' % num
+
+XML_HEADER_FIELD = re.compile(r'<(x|y|z|layerheight|layerpitch|speed)>\s*(\S+)\s*</\1>')
+XML_LAYER_TAG = re.compile(r'<layer id="|</layers>')
+XML_LOOP_TAG = re.compile(r'<loop id="[^"]*">')
+XML_CHUNK_TAG = re.compile(r'<chunk id="[^"]*">')
+XML_COORD = re.compile(r'<[xyz]>\s*(\S+)\s*</[xyz]>')
+XML_Z = re.compile(r'<z>\s*(\S+)\s*</z>')
+
+class SliceLayer(Layer):
+    ''' A layer of a slice file. z, loops and chunks are read from the
+    file the first time they are used.'''
+    def __init__(self, reader, n):
+        self.reader = reader
+        self.n = n
+        self.id = n + 1
+        self.pitch = reader.pitch
+        self.lines = []
+
+    def __getattr__(self, name):
+        if name == 'z':
+            self.z = self.reader.read_z(self.n)
+        elif name in ('loops', 'chunks'):
+            self.loops, self.chunks = self.reader.read_lines(self.n)
+        else:
+            raise AttributeError(name)
+        return self.__dict__[name]
+
+class LayerStream:
+    ''' The layers of a slice file reader, each read when it is reached
+    and not kept, so that streaming a file does not hold it all in
+    memory as reader.layers would'''
+    def __init__(self, reader):
+        self.reader = reader
+
+    def __len__(self):
+        return len(self.reader)
+
+    def __iter__(self):
+        for n in range(len(self.reader)):
+            yield SliceLayer(self.reader, n)
+
+class XmlSliceReader:
+    ''' Read an xml slice file written by XmlSliceWriter.
+
+    Opening only finds where each layer starts, the layers are parsed
+    when their SliceLayer in self.layers is used.
+    '''
+    def __init__(self, filename, blocksize=1 << 22):
+        self.f = f = open(filename, 'rb')
+        header = f.read(4096)
+        header = header[:header.find('<layers')]
+        fields = dict(XML_HEADER_FIELD.findall(header))
+        try:
+            self.xsize = float(fields['x'])
+            self.ysize = float(fields['y'])
+            self.zsize = float(fields['z'])
+            self.height = float(fields['layerheight'])
+            self.pitch = float(fields['layerpitch'])
+            self.speed = float(fields['speed'])
+        except (KeyError, ValueError):
+            raise FormatError('%s: not a slice file' % filename)
+        # the fast speed is not kept in xml files
+        self.fast = 0.0
+
+        f.seek(0)
+        self.offsets = []
+        end = None
+        base = 0
+        tail = ''
+        while True:
+            block = f.read(blocksize)
+            if not block:
+                break
+            data = tail + block
+            for m in XML_LAYER_TAG.finditer(data):
+                # a tag inside the tail was found in the last block
+                if m.end() <= len(tail):
+                    continue
+                if m.group() == '</layers>':
+                    end = base - len(tail) + m.start()
+                else:
+                    self.offsets.append(base - len(tail) + m.start())
+            tail = data[-10:]
+            base += len(block)
+        if end is None:
+            raise FormatError('%s: slice file is truncated' % filename)
+        self.offsets.append(end)
+        self.layers = [SliceLayer(self, n) for n in range(len(self))]
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def read_text(self, n, size=None):
+        start = self.offsets[n]
+        if size is None:
+            size = self.offsets[n + 1] - start
+        self.f.seek(start)
+        return self.f.read(size)
+
+    def read_z(self, n):
+        m = XML_Z.search(self.read_text(n, 4096))
+        if m is None:
+            return 0.0
+        return float(m.group(1))
+
+    def read_lines(self, n):
+        text = self.read_text(n)
+        pos = text.find('<chunks')
+        if pos < 0:
+            raise FormatError('no chunks in layer %d' % (n + 1))
+        loops = [parse_xml_lines(t) for t in XML_LOOP_TAG.split(text[:pos])[1:]]
+        chunks = [parse_xml_lines(t) for t in XML_CHUNK_TAG.split(text[pos:])[1:]]
+        return (loops, chunks)
+
+    def close(self):
+        self.f.close()
+
+def parse_xml_lines(text):
+    c = map(float, XML_COORD.findall(text))
+    return [Line(Point(c[i], c[i + 1], c[i + 2]), Point(c[i + 3], c[i + 4], c[i + 5]))
+            for i in range(0, len(c) - 5, 6)]
+
+# Binary slice file (.bcs), all little endian:
+#   header   BINARY_HEADER: magic, version, coordinate type ('f' float32
+#            or 'd' float64), x/y/z size, layer height, pitch, speed, fast
+#   layers   BINARY_LAYER: z, id, number of loops, number of chunks
+#            followed by the number of lines of each loop and chunk as
+#            uint32 and then x1, y1, x2, y2 of every line
+#   index    uint64 file offset of each layer
+#   footer   BINARY_FOOTER: offset of the index, number of layers, magic
+BINARY_MAGIC = 'BCSLICE\0'
+BINARY_VERSION = 1
+BINARY_HEADER = struct.Struct('<8sIc3x7d')
+BINARY_LAYER = struct.Struct('<dIII')
+BINARY_FOOTER = struct.Struct('<QI4x8s')
+BINARY_TYPES = {'f': '<f4', 'd': '<f8'}
+
+class BinarySliceWriter:
+    ''' Write a slice result as a .bcs file, one layer at a time.
+
+    It works like XmlSliceWriter. The coordinates are stored as float32,
+    or as float64 if code is 'd'.
+    '''
+    def __init__(self, filename, code='f', bufsize=1 << 16):
+        self.filename = filename
+        self.f = open(filename, 'wb', bufsize)
+        self.code = code
+        self.dtype = numpy.dtype(BINARY_TYPES[code])
+        self.offsets = []
+
+    def begin(self, cadmodel, num=None):
+        self.f.write(BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, self.code,
+                                        cadmodel.xsize, cadmodel.ysize, cadmodel.zsize,
+                                        cadmodel.height, cadmodel.pitch, cadmodel.speed,
+                                        cadmodel.fast))
+
+    def write_layer(self, layer):
+        self.offsets.append(self.f.tell())
+        groups = list(layer.loops) + list(layer.chunks)
+        counts = numpy.array([len(lines) for lines in groups], '<u4')
+        coords = numpy.array([(line.p1.x, line.p1.y, line.p2.x, line.p2.y)
+                              for lines in groups for line in lines], self.dtype)
+        self.f.write(BINARY_LAYER.pack(layer.z, layer.id, len(layer.loops), len(layer.chunks)))
+        self.f.write(counts.tostring())
+        self.f.write(coords.tostring())
+
+    def end(self):
+        f = self.f
+        pos = f.tell()
+        f.write(numpy.array(self.offsets, '<u8').tostring())
+        f.write(BINARY_FOOTER.pack(pos, len(self.offsets), BINARY_MAGIC))
+        f.close()
+
+    def abort(self):
+        remove_unfinished(self.f, self.filename)
+
+class BinarySliceReader:
+    ''' Random access to the layers of a .bcs file.
+
+    The header values are attributes named as in CadModel, and
+    read_layer(n) returns the nth layer as (z, id, loops, chunks) where
+    loops and chunks are lists of (n, 2, 2) arrays of line end points.
+    self.layers has a SliceLayer for each layer. A file that is not a
+    slice file or is cut short raises FormatError.
+    '''
+    def __init__(self, filename):
+        self.filename = filename
+        self.f = open(filename, 'rb')
+        try:
+            self.read_header()
+        except:
+            self.f.close()
+            raise
+
+    def read_header(self):
+        f = self.f
+        data = f.read(BINARY_HEADER.size)
+        if len(data) < BINARY_HEADER.size:
+            raise FormatError('%s: not a slice file' % self.filename)
+        (magic, version, code, self.xsize, self.ysize, self.zsize,
+         self.height, self.pitch, self.speed, self.fast) = BINARY_HEADER.unpack(data)
+        if magic != BINARY_MAGIC or code not in BINARY_TYPES:
+            raise FormatError('%s: not a slice file' % self.filename)
+        if version != BINARY_VERSION:
+            raise FormatError('%s: unknown slice file version %d' % (self.filename, version))
+        self.dtype = numpy.dtype(BINARY_TYPES[code])
+
+        f.seek(0, os.SEEK_END)
+        if f.tell() < BINARY_HEADER.size + BINARY_FOOTER.size:
+            raise FormatError('%s: slice file is truncated' % self.filename)
+        f.seek(-BINARY_FOOTER.size, os.SEEK_END)
+        pos, num, magic = BINARY_FOOTER.unpack(f.read(BINARY_FOOTER.size))
+        if magic != BINARY_MAGIC:
+            raise FormatError('%s: slice file is truncated' % self.filename)
+        f.seek(pos)
+        self.offsets = numpy.frombuffer(self.read(8 * num), '<u8').tolist()
+        self.layers = [SliceLayer(self, n) for n in range(num)]
+
+    def read(self, size):
+        data = self.f.read(size)
+        if len(data) < size:
+            raise FormatError('%s: slice file is truncated' % self.filename)
+        return data
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def read_layer(self, n):
+        f = self.f
+        f.seek(self.offsets[n])
+        z, id, nloops, nchunks = BINARY_LAYER.unpack(self.read(BINARY_LAYER.size))
+        counts = numpy.frombuffer(self.read(4 * (nloops + nchunks)), '<u4')
+        total = int(counts.sum())
+        coords = numpy.frombuffer(self.read(self.dtype.itemsize * 4 * total), self.dtype)
+        coords = coords.astype(float).reshape(total, 2, 2)
+        groups = numpy.split(coords, numpy.cumsum(counts)[:-1]) if len(counts) else []
+        return (z, id, groups[:nloops], groups[nloops:])
+
+    def read_z(self, n):
+        self.f.seek(self.offsets[n])
+        return BINARY_LAYER.unpack(self.read(BINARY_LAYER.size))[0]
+
+    def read_lines(self, n):
+        z, id, loops, chunks = self.read_layer(n)
+        loops = [arrays_to_lines(a, z) for a in loops]
+        chunks = [arrays_to_lines(a, z) for a in chunks]
+        return (loops, chunks)
+
+    def close(self):
+        self.f.close()
+
+def arrays_to_lines(a, z):
+    return [Line(Point(x1, y1, z), Point(x2, y2, z)) for (x1, y1), (x2, y2) in a.tolist()]
+
+def open_slice(filename):
+    ''' A reader for a .bcs or xml slice file'''
+    f = open(filename, 'rb')
+    magic = f.read(len(BINARY_MAGIC))
+    f.close()
+    if magic == BINARY_MAGIC:
+        return BinarySliceReader(filename)
+    else:
+        return XmlSliceReader(filename)
+
+def create_writer(filename):
+    ''' A binary writer for .bcs files, an xml writer otherwise'''
+    root, ext = os.path.splitext(filename)
+    if ext.lower() == '.bcs':
+        return BinarySliceWriter(filename)
+    else:
+        return XmlSliceWriter(filename)
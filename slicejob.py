@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+#-----------------------------------------------------------------------------
+# Author     : Zhigang Liu
+# Date       : Jan 2009
+# Email      : zgliu71@gmail.com
+# License    : General Public License 2 (GPL2)
+# Description: Slice a model in the background
+#-----------------------------------------------------------------------------
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+import sys
+import threading
+import traceback
+from cadmodel import SliceCancelled
+
+def call(handler, *args):
+    handler(*args)
+
+class SliceJob:
+    ''' Runs cadmodel.slice(para) in a thread of its own.
+
+    The handlers are called as post(handler, *args) from that thread,
+    the GUI passes wx.CallAfter to have them run in the wx loop:
+    on_start(num_layers), on_layer(count) after each layer, then one of
+    on_done(ok), on_cancel() or on_error(exc_info).
+    '''
+    def __init__(self, cadmodel, para, post=call, on_start=None, on_layer=None,
+                 on_done=None, on_cancel=None, on_error=None):
+        self.cadmodel = cadmodel
+        self.para = para
+        self.post = post
+        self.on_start = on_start
+        self.on_layer = on_layer
+        self.on_done = on_done
+        self.on_cancel = on_cancel
+        self.on_error = on_error
+        self.cancelled = threading.Event()
+        self.num_layers = None
+        self.thread = None
+
+    def start(self):
+        self.cadmodel.queue = self
+        self.cadmodel.cancelled = self.cancelled
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def cancel(self):
+        ''' Stop before the next layer'''
+        self.cancelled.set()
+
+    def is_running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def join(self, timeout=None):
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    def put(self, value):
+        ''' Called by CadModel.progress with the number of layers first,
+        then each layer done, then "done"'''
+        if value == "done":
+            return
+        if self.num_layers is None:
+            self.num_layers = value
+            self.notify(self.on_start, value)
+        else:
+            self.notify(self.on_layer, value)
+
+    def notify(self, handler, *args):
+        if handler is not None:
+            self.post(handler, *args)
+
+    def run(self):
+        try:
+            ok = self.cadmodel.slice(self.para)
+            result = (self.on_done, ok)
+        except SliceCancelled:
+            print 'slicing cancelled'
+            result = (self.on_cancel,)
+        except Exception:
+            traceback.print_exc()
+            result = (self.on_error, sys.exc_info())
+        finally:
+            self.cadmodel.queue = None
+            self.cadmodel.cancelled = None
+        self.notify(*result)
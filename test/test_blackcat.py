@@ -1,15 +1,75 @@
 import sys
 import os
 sys.path.append(os.path.join(sys.path[0], ".."))
-from blackcat import *
+from cadmodel import *
 import unittest
+import struct
+import Queue
+import shutil
+import tempfile
+import threading
+import time
+import ctypes
+import ctypes.util
+import numpy
+import batch
+from slicefile import *
+from cache import SliceCache, MeshCache
+from slicejob import SliceJob
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data")
+
+# the GL tests draw offscreen with OSMesa, or else EGL without a display
+if "PYOPENGL_PLATFORM" not in os.environ:
+    if ctypes.util.find_library("OSMesa"):
+        os.environ["PYOPENGL_PLATFORM"] = "osmesa"
+    elif ctypes.util.find_library("EGL"):
+        os.environ["PYOPENGL_PLATFORM"] = "egl"
+        os.environ.setdefault("EGL_PLATFORM", "surfaceless")
+
+gl_context = None
+
+def create_gl_context(size=64):
+    ''' Make an offscreen GL context current, False if there is none'''
+    global gl_context
+    if gl_context is not None:
+        return gl_context is not False
+    gl_context = False
+    try:
+        platform = os.environ.get("PYOPENGL_PLATFORM")
+        if platform == "osmesa":
+            from OpenGL import osmesa, arrays
+            from OpenGL.GL import GL_UNSIGNED_BYTE
+            context = osmesa.OSMesaCreateContextExt(osmesa.OSMESA_RGBA, 24, 0, 0, None)
+            buf = arrays.GLubyteArray.zeros((size, size, 4))
+            if context and osmesa.OSMesaMakeCurrent(context, buf, GL_UNSIGNED_BYTE, size, size):
+                gl_context = (context, buf)
+        elif platform == "egl":
+            from OpenGL import EGL
+            display = EGL.eglGetDisplay(EGL.EGL_DEFAULT_DISPLAY)
+            EGL.eglInitialize(display, None, None)
+            attributes = (EGL.EGLint * 9)(EGL.EGL_SURFACE_TYPE, EGL.EGL_PBUFFER_BIT,
+                                          EGL.EGL_RENDERABLE_TYPE, EGL.EGL_OPENGL_BIT,
+                                          EGL.EGL_DEPTH_SIZE, 24, EGL.EGL_RED_SIZE, 8, EGL.EGL_NONE)
+            config = EGL.EGLConfig()
+            num = EGL.EGLint()
+            EGL.eglChooseConfig(display, attributes, ctypes.pointer(config), 1, ctypes.pointer(num))
+            surface = EGL.eglCreatePbufferSurface(display, config,
+                                                  (EGL.EGLint * 5)(EGL.EGL_WIDTH, size, EGL.EGL_HEIGHT, size, EGL.EGL_NONE))
+            EGL.eglBindAPI(EGL.EGL_OPENGL_API)
+            context = EGL.eglCreateContext(display, config, EGL.EGL_NO_CONTEXT, None)
+            if EGL.eglMakeCurrent(display, surface, surface, context):
+                gl_context = (display, surface, context)
+    except Exception, e:
+        print "no offscreen GL:", e
+    return gl_context is not False
 
 class CadModelTest(unittest.TestCase):
     def setUp(self):
-        pass
+        self.dirname = tempfile.mkdtemp()
 
     def tearDown(self):
-        pass
+        shutil.rmtree(self.dirname)
 
     def testOpen(self):
         cadmodel = CadModel()
@@ -21,8 +81,13 @@ class CadModelTest(unittest.TestCase):
         ok = cadmodel.open("xxx.stl")
         self.assert_(not ok)
 
+    def testOpen_directory(self):
+        cadmodel = CadModel()
+        ok = cadmodel.open(self.dirname)
+        self.assert_(not ok)
+
     def testOpen_wrongformat(self):
-        fname = 'tmp.txt'
+        fname = os.path.join(self.dirname, 'tmp.txt')
         f = open(fname, 'w')
         print >> f, 'xxx'
         f.close()
@@ -32,7 +97,7 @@ class CadModelTest(unittest.TestCase):
         self.assert_(not ok)
 
     def testOpen_emptyfile(self):
-        fname = 'tmp.txt'
+        fname = os.path.join(self.dirname, 'tmp.txt')
         f = open(fname, 'w')
         f.close()
 
@@ -41,7 +106,7 @@ class CadModelTest(unittest.TestCase):
         self.assert_(not ok)
 
     def testOpen_normal(self):
-        fname = 'tmp.txt'
+        fname = os.path.join(self.dirname, 'tmp.txt')
         f = open(fname, 'w')
         print >> f, "solid TEST"
         print >> f, "facet norma"
@@ -101,5 +166,1013 @@ class CadModelTest(unittest.TestCase):
         self.assert_(ok)
         ok = hash(p1) == hash(p2)
         self.assert_(ok)
+
+class MeshTest(unittest.TestCase):
+    def setUp(self):
+        points = [[[0.0, 0.0, 0.0], [1.0, 0.0, 0.0], [0.0, 1.0, 0.0]],
+                  [[1.0, 0.0, 0.0], [1.0, 1.0, 0.0], [0.0, 1.0, -0.0]]]
+        normals = [[0.0, 0.0, 1.0], [0.0, 0.0, 1.0]]
+        self.mesh = create_mesh(points, normals)
+
+    def testCreateMesh(self):
+        mesh = self.mesh
+        self.assert_(len(mesh) == 2)
+        self.assert_(mesh.vertices.shape == (4, 3))
+        self.assert_(mesh.triangles.shape == (2, 3))
+        self.assert_(mesh.triangles[0][1] == mesh.triangles[1][0])
+        self.assert_(mesh.triangles[0][2] == mesh.triangles[1][2])
+
+    def testFacetView(self):
+        facet = self.mesh.get_facet(1)
+        self.assert_(facet.normal == Point(0.0, 0.0, 1.0))
+        self.assert_(facet.points[0] == Point(1.0, 0.0, 0.0))
+        self.assert_(facet.points[1] == Point(1.0, 1.0, 0.0))
+        self.assert_(facet.points[2] == Point(0.0, 1.0, 0.0))
+
+        facets = self.mesh.get_facets()
+        self.assert_(len(facets) == 2)
+        self.assert_(facets[1].points[1] == facet.points[1])
+
+    def testDirectionMatrix(self):
+        mesh = self.mesh.transform(direction_matrix("-X"))
+        facet = mesh.get_facet(1)
+        self.assert_(facet.points[1] == Point(0.0, 1.0, -1.0))
+        facet = self.mesh.get_facet(1)
+        self.assert_(facet.points[1] == Point(1.0, 1.0, 0.0))
+
+    def testTransform(self):
+        for direction in ("+X", "-X", "+Y", "-Y", "+Z", "-Z"):
+            mesh = self.mesh.transform(numpy.dot(direction_matrix(direction), scale_matrix(2.0)))
+            axes, signs = DIRECTIONS[direction]
+            expected = self.mesh.vertices[:, axes] * 2.0 * signs + 0.0
+            self.assert_((mesh.vertices == expected).all())
+            self.assert_(mesh.triangles is self.mesh.triangles)
+        self.assert_(self.mesh.vertices.tolist() == [[0.0, 0.0, 0.0], [0.0, 1.0, 0.0], [1.0, 0.0, 0.0], [1.0, 1.0, 0.0]])
+
+    def testRotation(self):
+        mesh = self.mesh.transform(rotation_matrix('z', 90))
+        self.assert_(mesh.vertices.tolist() == [[0.0, 0.0, 0.0], [-1.0, 0.0, 0.0], [0.0, 1.0, 0.0], [-1.0, 1.0, 0.0]])
+        mesh = self.mesh.transform(numpy.dot(translation_matrix(1.0, 2.0, 3.0), rotation_matrix('x', 30)))
+        self.assert_(numpy.allclose(mesh.vertices[3], [2.0, 2.0 + math.cos(math.pi / 6), 3.0 + 0.5]))
+        self.assert_(numpy.allclose(mesh.normals, [[0.0, -0.5, math.cos(math.pi / 6)]] * 2))
+
+    def testSliceRotated(self):
+        para = {"height":"1.0", "pitch":"0.5", "speed":"10", "fast":"20", "direction":"+Z", "scale":"1"}
+        cadmodel = CadModel()
+        cadmodel.open(os.path.join(DATA, "rect.stl"))
+        cadmodel.slice(para)
+        xsize, ysize, zsize = cadmodel.xsize, cadmodel.ysize, cadmodel.zsize
+        para["rotz"] = "-90"
+        cadmodel.slice(para)
+        self.assert_((cadmodel.xsize, cadmodel.ysize, cadmodel.zsize) == (ysize, xsize, zsize))
+        para["rotz"] = "45"
+        cadmodel.slice(para)
+        self.assert_(abs(cadmodel.xsize - (xsize + ysize) / math.sqrt(2)) < 1e-9)
+        self.assert_(len(cadmodel.layers) == 4)
+
+class LodTest(unittest.TestCase):
+    def setUp(self):
+        self.cadmodel = CadModel()
+        self.cadmodel.open(os.path.join(DATA, "gear2.stl"))
+        self.mesh = self.cadmodel.mesh
+
+    def testCluster(self):
+        lod = cluster_mesh(self.mesh, 16)
+        self.assert_(0 < len(lod) < len(self.mesh) / 2)
+        self.assert_((lod.vertices.min(axis=0) >= self.mesh.vertices.min(axis=0) - 1e-9).all())
+        self.assert_((lod.vertices.max(axis=0) <= self.mesh.vertices.max(axis=0) + 1e-9).all())
+        t = lod.triangles
+        self.assert_(((t[:, 0] != t[:, 1]) & (t[:, 1] != t[:, 2]) & (t[:, 2] != t[:, 0])).all())
+        self.assert_(numpy.allclose((lod.normals * lod.normals).sum(axis=1), 1.0))
+
+    def testLevels(self):
+        lods = create_lods(self.mesh)
+        self.assert_(len(lods) > 0)
+        sizes = [len(lod) for lod in lods] + [len(self.mesh)]
+        for coarse, fine in zip(sizes, sizes[1:]):
+            self.assert_(2 * coarse <= fine)
+        # a single facet has nothing to leave out
+        mesh = create_mesh([[[0.0, 0.0, 0.0], [1.0, 0.0, 0.0], [0.0, 1.0, 0.0]]], [[0.0, 0.0, 1.0]])
+        self.assert_(create_lods(mesh) == [])
+
+    def testPreview(self):
+        cadmodel = self.cadmodel
+        self.assert_(cadmodel.preview_mesh(1000) is None)
+        cadmodel.start_lods().join()
+        preview = cadmodel.preview_mesh(1000)
+        self.assert_(preview is cadmodel.lods[0])
+        self.assert_(cadmodel.preview_mesh(len(self.mesh)) is None)
+
+        para = {"height":"1.0", "pitch":"1.0", "speed":"10", "fast":"20", "direction":"-Y", "scale":"2"}
+        cadmodel.slice(para)
+        preview = cadmodel.preview_mesh(1000)
+        self.assert_(len(preview) == len(cadmodel.lods[0]))
+        size = cadmodel.mesh.vertices.max(axis=0) - cadmodel.mesh.vertices.min(axis=0)
+        lod_size = preview.vertices.max(axis=0) - preview.vertices.min(axis=0)
+        self.assert_(numpy.allclose(lod_size, size, rtol=0.1))
+
+        cadmodel.open(os.path.join(DATA, "hole.stl"))
+        self.assert_(cadmodel.lods == [])
+
+class AsciiStlTest(unittest.TestCase):
+    def parse(self, text):
+        dirname = tempfile.mkdtemp()
+        fname = os.path.join(dirname, 'tmp.txt')
+        f = open(fname, 'w')
+        f.write(text)
+        f.close()
+        f = open(fname)
+        try:
+            return parse_ascii_stl(f)
+        finally:
+            f.close()
+            shutil.rmtree(dirname)
+
+    def testParse(self):
+        text = "solid TEST\n" \
+               "facet normal 0 0 1\n" \
+               "outer loop\n" \
+               "vertex 0 0 0\n" \
+               "vertex 1.5 0 0\n" \
+               "vertex 0 1 -2e-001\n" \
+               "endloop\n" \
+               "endfacet\n" \
+               "endsolid TEST\n"
+        name, points, normals = self.parse(text)
+        self.assert_(name == 'TEST')
+        self.assert_(points.shape == (1, 3, 3))
+        self.assert_(points[0][1][0] == 1.5)
+        self.assert_(points[0][2][2] == -0.2)
+        self.assert_(normals.tolist() == [[0.0, 0.0, 1.0]])
+
+    def testLineNumber(self):
+        text = "solid TEST\n" \
+               "facet normal 0 0 1\n" \
+               "outer loop\n" \
+               "vertex 0 0 0\n" \
+               "vertex 1 x 0\n" \
+               "vertex 0 1 0\n" \
+               "endloop\n" \
+               "endfacet\n" \
+               "endsolid TEST\n"
+        try:
+            self.parse(text)
+            self.fail()
+        except FormatError, e:
+            self.assert_(e.lineno == 5)
+
+        text = text.replace("vertex 1 x 0", "vertex 1 0 0").replace("endloop", "endlop")
+        try:
+            self.parse(text)
+            self.fail()
+        except FormatError, e:
+            self.assert_(e.lineno == 7)
+
+    def testBlocks(self):
+        f = open(os.path.join(DATA, "hole.stl"))
+        name, points, normals = parse_ascii_stl(f)
+        f.seek(0)
+        name2, points2, normals2 = parse_ascii_stl(f, blocksize=100)
+        f.close()
+        self.assert_(name == name2)
+        self.assert_((points == points2).all())
+        self.assert_((normals == normals2).all())
+
+class BinaryStlTest(unittest.TestCase):
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp()
+        self.fname = os.path.join(self.dirname, 'tmp.stl')
+        self.ascii = CadModel()
+        self.ascii.open(os.path.join(DATA, "hole.stl"))
+        mesh = self.ascii.mesh
+
+        records = numpy.zeros(len(mesh), dtype=STL_BINARY_FACET)
+        records['normal'] = mesh.normals
+        records['points'] = mesh.facet_points()
+        f = open(self.fname, 'wb')
+        f.write('solid HOLE'.ljust(80, '\0'))
+        f.write(struct.pack('<I', len(records)))
+        f.write(records.tostring())
+        f.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.dirname)
+
+    def testIsBinary(self):
+        self.assert_(is_binary_stl(self.fname))
+        self.assert_(not is_binary_stl(os.path.join(DATA, "hole.stl")))
+
+    def testOpen(self):
+        cadmodel = CadModel()
+        ok = cadmodel.open(self.fname)
+        self.assert_(ok)
+        self.assert_(cadmodel.modelName == 'HOLE')
+        self.assert_(len(cadmodel.mesh) == len(self.ascii.mesh))
+        diff = cadmodel.mesh.facet_points() - self.ascii.mesh.facet_points()
+        self.assert_(abs(diff).max() < 1e-5)
+
+    def testTruncated(self):
+        f = open(self.fname, 'ab')
+        f.write('x')
+        f.close()
+        cadmodel = CadModel()
+        ok = cadmodel.open(self.fname)
+        self.assert_(not ok)
+
+class FacetSweepTest(unittest.TestCase):
+    def testActive(self):
+        cadmodel = CadModel()
+        cadmodel.open(os.path.join(DATA, "hole.stl"))
+        points = cadmodel.mesh.facet_points()
+        minz = points[:, :, 2].min(axis=1)
+        maxz = points[:, :, 2].max(axis=1)
+
+        sweep = FacetSweep(minz, maxz)
+        lastz = cadmodel.minz
+        for z in numpy.arange(cadmodel.minz + 0.3, cadmodel.maxz, 0.7):
+            ids = sweep.active(z, lastz)
+            expected = numpy.nonzero((minz <= z) & (maxz >= z))[0]
+            self.assert_(set(expected) <= set(ids))
+            self.assert_((minz[ids] <= z + LIMIT).all())
+            self.assert_((maxz[ids] >= lastz - LIMIT).all())
+
+            # A retried plane between lastz and z sees every facet it needs
+            redo = z - 0.2
+            if redo > lastz:
+                ids = sweep.active(redo, lastz)
+                expected = numpy.nonzero((minz <= redo) & (maxz >= redo))[0]
+                self.assert_(set(expected) <= set(ids))
+            lastz = z
+
+class IntersectFacetsTest(unittest.TestCase):
+    def compare(self, mesh, z):
+        code, segments = intersect_facets(mesh.facet_points(), z)
+        lines = []
+        for facet in mesh.get_facets():
+            fcode, line = facet.intersect(z)
+            if fcode == INTERSECTED:
+                lines.append(line)
+        self.assert_(len(segments) == len(lines))
+        for (p1, p2), line in zip(segments.tolist(), lines):
+            self.assert_(p1 == [line.p1.x, line.p1.y, line.p1.z])
+            self.assert_(p2 == [line.p2.x, line.p2.y, line.p2.z])
+
+    def testModels(self):
+        for name in sorted(os.listdir(DATA)):
+            cadmodel = CadModel()
+            self.assert_(cadmodel.open(os.path.join(DATA, name)))
+            step = cadmodel.zsize / 10
+            for i in range(11):
+                self.compare(cadmodel.mesh, cadmodel.minz + i * step)
+
+    def testVertexOnPlane(self):
+        points = [[[0.0, 0.0, 0.0], [2.0, 0.0, 2.0], [0.0, 2.0, 1.0]]]
+        mesh = create_mesh(points, [[0.0, 0.0, 1.0]])
+        for z in (0.0, 0.5, 1.0, 1.5, 2.0, 3.0):
+            self.compare(mesh, z)
+
+        code, segments = intersect_facets(mesh.facet_points(), 1.0)
+        self.assert_(code == INTERSECTED)
+        self.assert_(segments.tolist() == [[[1.0, 0.0, 1.0], [0.0, 2.0, 1.0]]])
+
+        # a vertex on the plane counts as above it
+        code, segments = intersect_facets(mesh.facet_points(), 2.0)
+        self.assert_(code == NOT_INTERSECTED and len(segments) == 0)
+        code, segments = intersect_facets(mesh.facet_points(), 0.0)
+        self.assert_(code == NOT_INTERSECTED)
+
+        # two vertices on the plane and one below give the edge between them
+        points = [[[0.0, 0.0, 1.0], [2.0, 0.0, 1.0], [0.0, 2.0, 0.0]]]
+        mesh = create_mesh(points, [[0.0, -1.0, 0.0]])
+        self.compare(mesh, 1.0)
+        code, segments = intersect_facets(mesh.facet_points(), 1.0)
+        self.assert_(segments.tolist() == [[[2.0, 0.0, 1.0], [0.0, 0.0, 1.0]]])
+
+    def testLayersOnVertices(self):
+        # the planes go through the top and the corners of rect.stl
+        for engine in CadModel.engines:
+            cadmodel = CadModel()
+            cadmodel.engine = engine
+            cadmodel.open(os.path.join(DATA, "rect.stl"))
+            para = {"height":str(cadmodel.zsize / 4), "pitch":"0.5", "speed":"10", "fast":"20", "direction":"+Z", "scale":"1"}
+            cadmodel.slice(para)
+            self.assert_(len(cadmodel.layers) == 4)
+            self.assert_(cadmodel.layers[-1].z == cadmodel.maxz)
+            for layer in cadmodel.layers:
+                self.assert_(len(layer.loops) == 1 and len(layer.loops[0]) == 4)
+
+    def testVertexNearPlane(self):
+        # a vertex within LIMIT of the plane is taken as on it
+        points = [[[0.0, 0.0, 0.0], [2.0, 0.0, 2.0], [0.0, 2.0, 1.0 - 1e-12]]]
+        mesh = create_mesh(points, [[0.0, 0.0, 1.0]])
+        self.compare(mesh, 1.0)
+        code, segments = intersect_facets(mesh.facet_points(), 1.0)
+        self.assert_(segments.tolist() == [[[1.0, 0.0, 1.0], [0.0, 2.0, 1.0]]])
+
+    def testPlaneHeights(self):
+        cadmodel = CadModel()
+        cadmodel.open(os.path.join(DATA, "island.stl"))
+        cadmodel.minz, cadmodel.maxz, cadmodel.height = 0.0, 30.0, 0.1
+        zs = cadmodel.plane_heights()
+        self.assert_(len(zs) == 300)
+        self.assert_(zs == [k * 0.1 for k in range(1, 301)])
+
+    def testGrazingPlanes(self):
+        # planes that only graze a face once crashed on the sliver left
+        # there, or on loops that did not quite close
+        cases = [("island.stl", "-X", "0.1"), ("island.stl", "-X", "0.2"),
+                 ("island.stl", "-Y", "0.1"), ("island.stl", "-Y", "0.2"),
+                 ("island.stl", "+Y", "0.05"), ("island.stl", "+Y", "0.1"),
+                 ("island.stl", "+Y", "0.2"), ("high_low.stl", "-X", "0.05")]
+        for name, direction, height in cases:
+            for engine in CadModel.engines:
+                cadmodel = CadModel()
+                cadmodel.engine = engine
+                cadmodel.open(os.path.join(DATA, name))
+                para = {"height":height, "pitch":"1", "speed":"10", "fast":"20", "direction":direction, "scale":"1"}
+                self.assert_(cadmodel.slice(para))
+                for layer in cadmodel.layers:
+                    for loop in layer.loops:
+                        self.assert_(len(loop) >= 3 and loop[-1].p2 is loop[0].p1)
+
+class ParallelSliceTest(unittest.TestCase):
+    def slice(self, processes):
+        cadmodel = CadModel()
+        cadmodel.open(os.path.join(DATA, "hole.stl"))
+        cadmodel.queue = Queue.Queue()
+        cadmodel.processes = processes
+        para = {"height":"0.5", "pitch":"0.5", "speed":"10", "fast":"20", "direction":"+Z", "scale":"1"}
+        cadmodel.slice(para)
+        return cadmodel
+
+    def testParallel(self):
+        serial = self.slice(1)
+        parallel = self.slice(2)
+        self.assert_(len(serial.layers) == len(parallel.layers))
+        for layer1, layer2 in zip(serial.layers, parallel.layers):
+            self.assert_(layer1.id == layer2.id)
+            self.assert_(layer1.z == layer2.z)
+            self.assert_(len(layer1.loops) == len(layer2.loops))
+            self.assert_(len(layer1.chunks) == len(layer2.chunks))
+            for lines1, lines2 in zip(layer1.loops + layer1.chunks, layer2.loops + layer2.chunks):
+                self.assert_(len(lines1) == len(lines2))
+                for line1, line2 in zip(lines1, lines2):
+                    self.assert_(line1.p1 == line2.p1 and line1.p2 == line2.p2)
+
+        # Progress is still reported in z order
+        total = parallel.queue.get()
+        self.assert_(total >= len(parallel.layers))
+        counts = []
+        while True:
+            count = parallel.queue.get()
+            if count == 'done':
+                break
+            counts.append(count)
+        self.assert_(counts == range(1, len(parallel.layers) + 1))
+
+    def testWorker(self):
+        # the workers share the mesh and never make all the facet points
+        cadmodel = CadModel()
+        cadmodel.open(os.path.join(DATA, "hole.stl"))
+        cadmodel.height = cadmodel.pitch = 0.5
+        mesh = cadmodel.mesh
+        minz, maxz = facet_bounds(mesh)
+        order = numpy.argsort(minz, kind='mergesort')
+        arrays = [share_array(a) for a in (mesh.vertices, mesh.triangles, mesh.normals, minz, maxz, order)]
+        init_slice_worker(*(arrays + [0.5, 0.5, 'vector']))
+        import cadmodel as module
+        worker = module.worker
+        zs = [cadmodel.minz + 0.5 * i for i in range(1, 5)]
+        results = slice_planes(zs)
+        self.assert_(worker.mesh.points is None)
+        # the layers come back as arrays, which are made into lines in
+        # the parent only when they are used
+        for z, (code, packed) in zip(zs, results):
+            expected = cadmodel.create_one_layer(z)[1]
+            self.assert_(code == LAYER and packed[0] == expected.z)
+            self.assert_(isinstance(packed[3], numpy.ndarray))
+            layer = PackedLayer(0.5, *packed)
+            self.assert_('loops' not in layer.__dict__)
+            for lines1, lines2 in zip(layer.loops + layer.chunks, expected.loops + expected.chunks):
+                self.assert_(len(lines1) == len(lines2))
+                for line1, line2 in zip(lines1, lines2):
+                    self.assert_(line1.p1 == line2.p1 and line1.p2 == line2.p2)
+            self.assert_(len(layer.loops) == len(expected.loops))
+            self.assert_(len(layer.chunks) == len(expected.chunks))
+
+class EndpointMapTest(unittest.TestCase):
+    def testStraddle(self):
+        q = EndpointMap.QUANTUM
+        p1 = Point(3 * q - LIMIT / 4, 1.0, 0.0)
+        p2 = Point(3 * q + LIMIT / 4, 1.0, 0.0)
+        lines = [Line(Point(0.0, 0.0, 0.0), p1)]
+        endpoints = EndpointMap(lines)
+        self.assert_(endpoints.key(p1) != endpoints.key(p2))
+        self.assert_(endpoints.find(p2, [False]) == (0, 1))
+        self.assert_(endpoints.find(p2, [True]) is None)
+        self.assert_(endpoints.find(Point(3 * q + 2 * LIMIT, 1.0, 0.0), [False]) is None)
+
+    def testCreateLoops(self):
+        a = Point(0.0, 0.0, 1.0)
+        b = Point(2.0, 0.0, 1.0)
+        c = Point(2.0, 1.0, 1.0)
+        d = Point(0.0, 1.0, 1.0)
+        e = Point(5.0, 5.0, 1.0)
+        f = Point(6.0, 5.0, 1.0)
+        g = Point(5.0, 6.0, 1.0)
+        layer = Layer(1.0, 0.5)
+        layer.lines = [Line(c, b), Line(e, f), Line(a, b), Line(g, e), Line(d, c), Line(a, d), Line(f, g)]
+        ok = layer.createLoops()
+        self.assert_(ok)
+        self.assert_(len(layer.loops) == 2)
+        self.assert_([len(loop) for loop in layer.loops] == [3, 4])
+        for loop in layer.loops:
+            for i in range(len(loop)):
+                self.assert_(loop[i - 1].p2 == loop[i].p1)
+
+class ScanlineTest(unittest.TestCase):
+    def testDiamond(self):
+        points = [Point(0.0, -1.0, 1.0), Point(1.0, 0.0, 1.0), Point(0.0, 1.0, 1.0), Point(-1.0, 0.0, 1.0)]
+        lines = [Line(points[i - 1], points[i]) for i in range(4)]
+        layer = Layer(1.0, 0.5)
+        ok = layer.set_lines(lines)
+        self.assert_(ok)
+        layer.create_scanlines()
+        spans = [[(line.p1.x, line.p2.x) for line in scanline] for scanline in layer.scanlines]
+        self.assert_(spans == [[(-0.5, 0.5)], [(-1.0, 1.0)], [(-0.5, 0.5)]])
+
+    def testPeak(self):
+        points = [Point(0.0, 0.0, 1.0), Point(4.0, 0.0, 1.0), Point(4.0, 2.0, 1.0),
+                  Point(2.0, 1.0, 1.0), Point(0.0, 2.0, 1.0)]
+        loop = [Line(points[i - 1], points[i]) for i in range(5)]
+
+        layer = Layer(1.0, 1.0)
+        layer.loops = [loop]
+        code, scanline = layer.create_one_scanline(1.0)
+        self.assert_(code == SCANLINE)
+        self.assert_([(l.p1.x, l.p2.x) for l in scanline] == [(0.0, 4.0)])
+        # only the two top corners touch y = 2
+        code, scanline = layer.create_one_scanline(2.0)
+        self.assert_(code == NOT_SCANLINE)
+        # the bottom line is on y = 0, the loop lies above it
+        code, scanline = layer.create_one_scanline(0.0)
+        self.assert_(code == NOT_SCANLINE)
+
+    def testChunks(self):
+        def span(x1, x2, y):
+            return Line(Point(x1, y, 0.0), Point(x2, y, 0.0))
+        a0 = span(0.0, 1.0, 0.0)
+        b0 = span(3.0, 4.0, 0.0)
+        a1 = span(0.0, 1.0, 1.0)
+        b1 = span(3.0, 4.0, 1.0)
+        c2 = span(0.0, 4.0, 2.0)
+        d4 = span(0.0, 4.0, 4.0)
+        layer = Layer(0.0, 1.0)
+        layer.scanlines = [[a0, b0], [a1, b1], [c2], [d4]]
+        layer.create_chunks()
+        self.assert_(layer.chunks == [[a0, a1, c2], [b0, b1], [d4]])
+
+    def testEdgeTable(self):
+        cadmodel = CadModel()
+        cadmodel.open(os.path.join(DATA, "island.stl"))
+        cadmodel.queue = Queue.Queue()
+        para = {"height":"1.0", "pitch":"0.5", "speed":"10", "fast":"20", "direction":"+Z", "scale":"1"}
+        cadmodel.slice(para)
+        for layer in cadmodel.layers:
+            edges = EdgeTable(layer.loops)
+            lasty = layer.miny
+            y = layer.miny + 0.3
+            while y < layer.maxy:
+                active = edges.active(y, lasty)
+                code, scanline = layer.create_one_scanline(y, active)
+                code2, scanline2 = layer.create_one_scanline(y)
+                self.assert_(code == code2)
+                if code == SCANLINE:
+                    self.assert_([(l.p1.x, l.p2.x) for l in scanline] == [(l.p1.x, l.p2.x) for l in scanline2])
+                lasty = y
+                y += 0.3
+
+class XmlSliceWriterTest(unittest.TestCase):
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dirname)
+
+    def testStream(self):
+        para = {"height":"1.0", "pitch":"0.5", "speed":"10", "fast":"20", "direction":"+Z", "scale":"1"}
+        saved = os.path.join(self.dirname, "saved.xml")
+        cadmodel = CadModel()
+        cadmodel.open(os.path.join(DATA, "hole.stl"))
+        cadmodel.slice(para)
+        cadmodel.save(saved)
+
+        streamed = os.path.join(self.dirname, "streamed.xml")
+        cadmodel = CadModel()
+        cadmodel.open(os.path.join(DATA, "hole.stl"))
+        ok = cadmodel.slice(para, XmlSliceWriter(streamed))
+        self.assert_(ok)
+        self.assert_(cadmodel.layers == [] and not cadmodel.sliced)
+        self.assert_(cadmodel.num_layers == 10)
+
+        lines1 = open(saved).read().splitlines()
+        lines2 = open(streamed).read().splitlines()
+        self.assert_(lines1[11] == '<layers num=" 10 ">')
+        self.assert_(lines2[11].rstrip() == lines1[11])
+        del lines1[11], lines2[11]
+        self.assert_(lines1 == lines2)
+
+    def testBinary(self):
+        para = {"height":"0.5", "pitch":"0.5", "speed":"10", "fast":"20", "direction":"+Z", "scale":"1"}
+        cadmodel = CadModel()
+        cadmodel.open(os.path.join(DATA, "island.stl"))
+        cadmodel.slice(para)
+        filename = os.path.join(self.dirname, "island.bcs")
+        writer = BinarySliceWriter(filename, 'd')
+        writer.begin(cadmodel)
+        for layer in cadmodel.layers:
+            writer.write_layer(layer)
+        writer.end()
+
+        reader = BinarySliceReader(filename)
+        self.assert_(len(reader) == len(cadmodel.layers))
+        self.assert_((reader.xsize, reader.height, reader.pitch) == (cadmodel.xsize, 0.5, 0.5))
+        for n in (len(reader) - 1, 0, 7):
+            layer = cadmodel.layers[n]
+            z, id, loops, chunks = reader.read_layer(n)
+            self.assert_(z == layer.z and id == layer.id)
+            self.assert_(len(loops) == len(layer.loops) and len(chunks) == len(layer.chunks))
+            for lines, array in zip(layer.loops + layer.chunks, loops + chunks):
+                expected = [[[l.p1.x, l.p1.y], [l.p2.x, l.p2.y]] for l in lines]
+                self.assert_(array.tolist() == expected)
+        reader.close()
+
+        # float32 by default, picked by the file extension
+        filename = os.path.join(self.dirname, "island32.bcs")
+        cadmodel.save(filename)
+        reader = BinarySliceReader(filename)
+        z, id, loops, chunks = reader.read_layer(3)
+        expected = [[[l.p1.x, l.p1.y], [l.p2.x, l.p2.y]] for l in cadmodel.layers[3].loops[0]]
+        self.assert_(numpy.allclose(loops[0], expected, atol=1e-5))
+        reader.close()
+
+    def testAbort(self):
+        para = {"height":"1.0", "pitch":"0.5", "speed":"10", "fast":"20", "direction":"+Z", "scale":"1"}
+        for name in ("aborted.xml", "aborted.bcs"):
+            filename = os.path.join(self.dirname, name)
+            cadmodel = CadModel()
+            cadmodel.open(os.path.join(DATA, "hole.stl"))
+            cadmodel.cancelled = threading.Event()
+            cadmodel.cancelled.set()
+            self.assertRaises(SliceCancelled, cadmodel.slice, para, create_writer(filename))
+            self.assert_(not os.path.exists(filename))
+
+class SliceReaderTest(unittest.TestCase):
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp()
+        para = {"height":"0.5", "pitch":"0.5", "speed":"10", "fast":"20", "direction":"+Z", "scale":"1"}
+        self.cadmodel = CadModel()
+        self.cadmodel.open(os.path.join(DATA, "island.stl"))
+        self.cadmodel.slice(para)
+
+    def tearDown(self):
+        shutil.rmtree(self.dirname)
+
+    def compare(self, layers, tolerance=LIMIT):
+        self.assert_(len(layers) == len(self.cadmodel.layers))
+        for layer1, layer2 in zip(self.cadmodel.layers, layers):
+            self.assert_(layer1.id == layer2.id)
+            self.assert_(abs(layer1.z - layer2.z) < 1e-6)
+            self.assert_(len(layer1.loops) == len(layer2.loops))
+            self.assert_(len(layer1.chunks) == len(layer2.chunks))
+            for lines1, lines2 in zip(layer1.loops + layer1.chunks, layer2.loops + layer2.chunks):
+                self.assert_(len(lines1) == len(lines2))
+                for line1, line2 in zip(lines1, lines2):
+                    for p1, p2 in ((line1.p1, line2.p1), (line1.p2, line2.p2)):
+                        self.assert_(abs(p1.x - p2.x) < tolerance and abs(p1.y - p2.y) < tolerance)
+
+    def testXml(self):
+        filename = os.path.join(self.dirname, "island.xml")
+        self.cadmodel.save(filename)
+        # a small block size puts tags across block ends
+        reader = XmlSliceReader(filename, 37)
+        self.assert_(reader.height == 0.5 and reader.xsize == self.cadmodel.xsize)
+        self.assert_('loops' not in reader.layers[3].__dict__)
+        self.compare(reader.layers)
+        reader.close()
+
+    def testBinary(self):
+        filename = os.path.join(self.dirname, "island.bcs")
+        writer = BinarySliceWriter(filename, 'd')
+        writer.begin(self.cadmodel)
+        for layer in self.cadmodel.layers:
+            writer.write_layer(layer)
+        writer.end()
+        reader = open_slice(filename)
+        self.assert_(isinstance(reader, BinarySliceReader))
+        self.compare(reader.layers)
+        reader.close()
+
+    def testTruncated(self):
+        filename = os.path.join(self.dirname, "island.bcs")
+        self.cadmodel.save(filename)
+        data = open(filename, 'rb').read()
+        for size in (10, len(data) // 2, len(data) - 1):
+            f = open(filename, 'wb')
+            f.write(data[:size])
+            f.close()
+            self.assertRaises(FormatError, BinarySliceReader, filename)
+            self.assert_(not CadModel().load_slice(filename))
+
+        # a layer cut short in a file that has its footer
+        f = open(filename, 'wb')
+        f.write(data)
+        f.close()
+        reader = BinarySliceReader(filename)
+        reader.offsets[1] = len(data) - 20
+        self.assertRaises(FormatError, reader.read_layer, 1)
+        reader.close()
+
+    def testLoadSlice(self):
+        filename = os.path.join(self.dirname, "island.xml")
+        self.cadmodel.save(filename)
+        cadmodel = CadModel()
+        self.assert_(cadmodel.load_slice(filename))
+        self.assert_(cadmodel.sliced and cadmodel.curr_layer == 0)
+        cadmodel.prev_layer()
+        self.assert_(cadmodel.get_curr_layer().id == len(self.cadmodel.layers))
+        self.assert_(abs(cadmodel.xcenter - self.cadmodel.xcenter) < 1.0)
+        self.assert_(cadmodel.dimension["newz"] == str(self.cadmodel.zsize))
+
+        # a loaded slice can be saved in the other format
+        filename = os.path.join(self.dirname, "island.bcs")
+        cadmodel.save(filename)
+        cadmodel = CadModel()
+        self.assert_(cadmodel.load_slice(filename))
+        self.compare(cadmodel.layers, 1e-4)
+
+        self.assert_(not cadmodel.load_slice(os.path.join(DATA, "rect.stl")))
+
+class SliceCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp()
+        self.cache = SliceCache(os.path.join(self.dirname, "cache"))
+
+    def tearDown(self):
+        shutil.rmtree(self.dirname)
+
+    def slice(self, name, pitch="0.5"):
+        cadmodel = CadModel()
+        cadmodel.open(os.path.join(DATA, name))
+        cadmodel.slice_cache = self.cache
+        para = {"height":"1.0", "pitch":pitch, "speed":"10", "fast":"20", "direction":"-X", "scale":"2"}
+        cadmodel.slice(para)
+        return cadmodel
+
+    def testMissingDir(self):
+        shutil.rmtree(self.cache.dirname)
+        cadmodel = self.slice("hole.stl")
+        self.assert_(cadmodel.sliced and len(cadmodel.layers) > 0)
+
+    def testHit(self):
+        cadmodel1 = self.slice("hole.stl")
+        self.assert_(len(os.listdir(self.cache.dirname)) == 1)
+        cadmodel2 = self.slice("hole.stl")
+        self.assert_(cadmodel2.slice_file is not None)
+        self.assert_(len(cadmodel1.layers) == len(cadmodel2.layers))
+        for layer1, layer2 in zip(cadmodel1.layers, cadmodel2.layers):
+            self.assert_(layer1.id == layer2.id and layer1.z == layer2.z)
+            for lines1, lines2 in zip(layer1.loops + layer1.chunks, layer2.loops + layer2.chunks):
+                self.assert_(len(lines1) == len(lines2))
+                for line1, line2 in zip(lines1, lines2):
+                    self.assert_(line1.p1 == line2.p1 and line1.p2 == line2.p2)
+        self.assert_(cadmodel1.xsize == cadmodel2.xsize)
+
+        # the saved files are the same either way
+        filename1 = os.path.join(self.dirname, "1.xml")
+        filename2 = os.path.join(self.dirname, "2.xml")
+        cadmodel1.save(filename1)
+        cadmodel2.save(filename2)
+        self.assert_(open(filename1).read() == open(filename2).read())
+
+        # another pitch is another result
+        self.slice("hole.stl", "0.25")
+        self.assert_(len(os.listdir(self.cache.dirname)) == 2)
+
+    def testEvict(self):
+        self.slice("hole.stl")
+        self.slice("rect.stl")
+        names = sorted(os.listdir(self.cache.dirname))
+        sizes = [os.path.getsize(os.path.join(self.cache.dirname, name)) for name in names]
+        self.cache.maxsize = max(sizes)
+        # hole is used last, so rect goes
+        self.slice("hole.stl")
+        self.slice("island.stl")
+        self.assert_(len(os.listdir(self.cache.dirname)) == 1)
+        self.cache.maxsize = 1 << 30
+        cadmodel = self.slice("island.stl")
+        self.assert_(cadmodel.slice_file is not None)
+
+    def testStreamHit(self):
+        self.slice("island.stl")
+        streamed = os.path.join(self.dirname, "streamed.xml")
+        cadmodel = CadModel()
+        cadmodel.open(os.path.join(DATA, "island.stl"))
+        cadmodel.slice_cache = self.cache
+        para = {"height":"1.0", "pitch":"0.5", "speed":"10", "fast":"20", "direction":"-X", "scale":"2"}
+        self.assert_(cadmodel.slice(para, XmlSliceWriter(streamed)))
+        self.assert_(cadmodel.slice_file is not None and cadmodel.num_layers > 0)
+        # the reader has not kept the lines of the layers it streamed
+        for layer in cadmodel.slice_file.layers:
+            self.assert_("loops" not in layer.__dict__)
+
+    def testAbort(self):
+        writer = self.cache.writer("abc")
+        writer.abort()
+        self.assert_(os.listdir(self.cache.dirname) == [])
+
+    def testSharedSize(self):
+        dirname = self.cache.dirname
+        def create(name, age):
+            filename = os.path.join(dirname, name)
+            open(filename, "wb").write("x" * 600)
+            t = time.time() - age
+            os.utime(filename, (t, t))
+        create("a.bcmesh", 100)
+        create("b.bcs", 50)
+        create("c.tmp", 2 * 3600)
+        create("d.tmp", 10)
+        self.cache.maxsize = 1000
+        self.cache.evict()
+        # the older mesh goes for the slice, and the tmp file of a killed writer
+        self.assert_(sorted(os.listdir(dirname)) == ["b.bcs", "d.tmp"])
+
+class SliceJobTest(unittest.TestCase):
+    def setUp(self):
+        self.cadmodel = CadModel()
+        self.cadmodel.open(os.path.join(DATA, "island.stl"))
+        self.para = {"height":"1.0", "pitch":"1.0", "speed":"10", "fast":"20", "direction":"+Z", "scale":"1"}
+        self.events = []
+
+    def record(self, name):
+        return lambda *args: self.events.append((name,) + args)
+
+    def run_job(self):
+        handlers = {}
+        for name in ("on_start", "on_layer", "on_done", "on_cancel", "on_error"):
+            handlers[name] = self.record(name)
+        job = SliceJob(self.cadmodel, self.para, **handlers).start()
+        job.join(60)
+        self.assert_(not job.is_running())
+        self.assert_(self.cadmodel.queue is None and self.cadmodel.cancelled is None)
+        return job
+
+    def testDone(self):
+        self.run_job()
+        names = [event[0] for event in self.events]
+        self.assert_(names[0] == "on_start")
+        self.assert_(names[-1] == "on_done" and self.events[-1][1])
+        self.assert_(names.count("on_layer") == len(self.cadmodel.layers) > 0)
+        self.assert_(self.cadmodel.sliced)
+
+    def testCancel(self):
+        self.dirname = tempfile.mkdtemp()
+        self.cadmodel.slice_cache = SliceCache(self.dirname)
+        def on_layer(count):
+            self.events.append(count)
+            if count == 2:
+                job.cancel()
+        job = SliceJob(self.cadmodel, self.para, on_layer=on_layer,
+                       on_done=lambda ok: self.events.append("done"),
+                       on_cancel=lambda: self.events.append("cancel"))
+        job.start().join(60)
+        try:
+            self.assert_(self.events == [1, 2, "cancel"])
+            self.assert_(not self.cadmodel.sliced and self.cadmodel.layers == [])
+            self.assert_(os.listdir(self.dirname) == [])
+        finally:
+            shutil.rmtree(self.dirname)
+
+        self.events = []
+        self.cadmodel.slice_cache = None
+        self.run_job()
+        self.assert_(self.events[-1] == ("on_done", True))
+
+    def testError(self):
+        self.para["height"] = "abc"
+        self.run_job()
+        self.assert_(len(self.events) == 1 and self.events[0][0] == "on_error")
+        self.assert_(self.events[0][1][0] is ValueError)
+
+class MeshCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp()
+        self.cache = MeshCache(os.path.join(self.dirname, "cache"))
+        self.filename = os.path.join(self.dirname, "hole.stl")
+        shutil.copy(os.path.join(DATA, "hole.stl"), self.filename)
+
+    def tearDown(self):
+        shutil.rmtree(self.dirname)
+
+    def open(self):
+        cadmodel = CadModel()
+        cadmodel.mesh_cache = self.cache
+        self.assert_(cadmodel.open(self.filename))
+        return cadmodel
+
+    def testHit(self):
+        cadmodel1 = self.open()
+        self.assert_(self.cache.get(self.filename) is not None)
+        cadmodel2 = self.open()
+        self.assert_(isinstance(cadmodel2.mesh.vertices, numpy.memmap))
+        self.assert_(cadmodel1.modelName == cadmodel2.modelName)
+        for name in ("vertices", "triangles", "normals"):
+            a1 = getattr(cadmodel1.mesh, name)
+            a2 = getattr(cadmodel2.mesh, name)
+            self.assert_(a1.dtype == a2.dtype and (a1 == a2).all())
+
+        para = {"height":"1.0", "pitch":"0.5", "speed":"10", "fast":"20", "direction":"+Y", "scale":"1.5"}
+        cadmodel1.slice(para)
+        cadmodel2.slice(para)
+        self.assert_(len(cadmodel1.layers) == len(cadmodel2.layers))
+
+    def testChanged(self):
+        self.open()
+        st = os.stat(self.filename)
+        # touched only
+        os.utime(self.filename, (st.st_atime, st.st_mtime + 10))
+        self.assert_(self.cache.get(self.filename) is not None)
+        # changed
+        f = open(self.filename, "a")
+        f.write("\n")
+        f.close()
+        self.assert_(self.cache.get(self.filename) is None)
+
+    def testMissingDir(self):
+        shutil.rmtree(self.cache.dirname)
+        cadmodel = self.open()
+        self.assert_(len(cadmodel.mesh) > 0)
+        self.assert_(self.cache.get(self.filename) is None)
+
+class ResliceTest(unittest.TestCase):
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp()
+        self.para = {"height":"1.0", "pitch":"0.5", "speed":"10", "fast":"20", "direction":"+Y", "scale":"1"}
+
+    def tearDown(self):
+        shutil.rmtree(self.dirname)
+
+    def save(self, cadmodel, name):
+        filename = os.path.join(self.dirname, name)
+        cadmodel.save(filename)
+        return open(filename).read()
+
+    def testPitch(self):
+        cadmodel = CadModel()
+        cadmodel.open(os.path.join(DATA, "island.stl"))
+        cadmodel.slice(self.para)
+        layers = cadmodel.layers[:]
+        mesh = cadmodel.mesh
+
+        self.para["speed"] = "20"
+        cadmodel.slice(self.para)
+        self.assert_(cadmodel.mesh is mesh)
+        self.assert_(cadmodel.layers == layers)
+
+        self.para["pitch"] = "0.3"
+        cadmodel.slice(self.para)
+        self.assert_(cadmodel.layers == layers)
+        fresh = CadModel()
+        fresh.open(os.path.join(DATA, "island.stl"))
+        fresh.slice(self.para)
+        self.assert_(self.save(cadmodel, "1.xml") == self.save(fresh, "2.xml"))
+
+        self.para["height"] = "0.5"
+        cadmodel.slice(self.para)
+        self.assert_(cadmodel.mesh is not mesh)
+        self.assert_(len(cadmodel.layers) > len(layers))
+
+class GLRenderTest(unittest.TestCase):
+    def setUp(self):
+        if not create_gl_context():
+            self.skipTest("no offscreen GL")
+        global glrender
+        import glrender
+        self.cadmodel = CadModel()
+        self.cadmodel.open(os.path.join(DATA, "hole.stl"))
+        self.para = {"height":"1.0", "pitch":"0.5", "speed":"10", "fast":"20", "direction":"+Z", "scale":"1"}
+        self.cadmodel.slice(self.para)
+
+    def render(self, draw):
+        from OpenGL import GL
+        cadmodel = self.cadmodel
+        GL.glViewport(0, 0, 64, 64)
+        GL.glMatrixMode(GL.GL_PROJECTION)
+        GL.glLoadIdentity()
+        GL.glOrtho(cadmodel.minx, cadmodel.maxx, cadmodel.miny, cadmodel.maxy,
+                   -cadmodel.maxz - 1, -cadmodel.minz + 1)
+        GL.glMatrixMode(GL.GL_MODELVIEW)
+        GL.glLoadIdentity()
+        GL.glClearColor(0, 0, 0, 1)
+        GL.glClear(GL.GL_COLOR_BUFFER_BIT | GL.GL_DEPTH_BUFFER_BIT)
+        draw()
+        GL.glFinish()
+        return GL.glReadPixels(0, 0, 64, 64, GL.GL_RGB, GL.GL_UNSIGNED_BYTE)
+
+    def testBuffers(self):
+        if not glrender.vbo_supported():
+            self.skipTest("no vertex buffer objects")
+        mesh = self.cadmodel.mesh
+        layer = self.cadmodel.layers[2]
+        for create, arg in ((glrender.create_model_buffer, mesh), (glrender.create_layer_buffer, layer)):
+            vbo = create(arg, True)
+            arrays = create(arg, False)
+            self.assert_(vbo.vbo is not None and arrays.vbo is None)
+            image = self.render(vbo.draw)
+            self.assert_(image.count(chr(0)) < len(image))
+            self.assert_(image == self.render(arrays.draw))
+            vbo.delete()
+            self.assert_(vbo.vbo is None)
+        self.assert_(glrender.create_layer_buffer(layer).count == 2 * (
+            sum(map(len, layer.chunks)) + sum(map(len, layer.loops))))
+        # the model buffer does not leave a copy of the facets on the mesh
+        buf = glrender.create_model_buffer(mesh, False)
+        self.assert_(mesh.points is None)
+        self.assert_((buf.data[:, :3] == mesh.vertices[mesh.triangles].reshape(-1, 3).astype(numpy.float32)).all())
+
+    def testLayerBuffers(self):
+        cadmodel = self.cadmodel
+        layer_buffers = glrender.LayerBuffers()
+        first = layer_buffers.get(cadmodel)
+        self.assert_(layer_buffers.get(cadmodel) is first)
+        cadmodel.next_layer()
+        second = layer_buffers.get(cadmodel)
+        self.assert_(second is not first)
+        cadmodel.prev_layer()
+        self.assert_(layer_buffers.get(cadmodel) is first)
+
+        # only the last layer shown fits
+        layer_buffers.maxvertices = 1
+        cadmodel.next_layer()
+        self.assert_(layer_buffers.get(cadmodel) is second)
+        self.assert_(first.count == 0 and layer_buffers.buffers.keys() == [2])
+
+        # a new slice drops them all
+        self.para["pitch"] = "0.25"
+        cadmodel.slice(self.para)
+        self.assert_(layer_buffers.get(cadmodel) is not second)
+        self.assert_(second.count == 0)
+        layer_buffers.clear()
+        self.assert_(layer_buffers.vertices == 0)
+
+class BatchTest(unittest.TestCase):
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dirname)
+
+    def testMain(self):
+        files = [os.path.join(DATA, name) for name in ("hole.stl", "rect.stl")]
+        code = batch.main(["-o", self.dirname, "--pitch", "0.5"] + files)
+        self.assert_(code == 0)
+        self.assert_(sorted(os.listdir(self.dirname)) == ["hole.xml", "rect.xml"])
+
+    def testFailure(self):
+        files = [os.path.join(DATA, "hole.stl"), os.path.join(self.dirname, "xxx.stl")]
+        code = batch.main(["-o", self.dirname, "-j", "2"] + files)
+        self.assert_(code == 1)
+        self.assert_(os.listdir(self.dirname) == ["hole.xml"])
+
+    def testErrors(self):
+        # poni.stl is thinner than a layer
+        files = [os.path.join(DATA, "poni.stl"), os.path.join(DATA, "hole.stl")]
+        code = batch.main(["-o", self.dirname] + files)
+        self.assert_(code == 1)
+        self.assert_(os.listdir(self.dirname) == ["hole.xml"])
+
+        # the output cannot be written
+        code = batch.main(["-o", os.path.join(self.dirname, "missing")] + files[1:])
+        self.assert_(code == 1)
+
+    def testCache(self):
+        cache_dir = os.path.join(self.dirname, "cache")
+        files = [os.path.join(DATA, "hole.stl")]
+        code = batch.main(["-o", self.dirname, "--cache-dir", cache_dir] + files)
+        self.assert_(code == 0)
+        xml = open(os.path.join(self.dirname, "hole.xml")).read()
+        os.remove(os.path.join(self.dirname, "hole.xml"))
+        code = batch.main(["-o", self.dirname, "--cache-dir", cache_dir] + files)
+        self.assert_(code == 0)
+        self.assert_(open(os.path.join(self.dirname, "hole.xml")).read() == xml)
+        self.assert_(sorted([os.path.splitext(name)[1] for name in os.listdir(cache_dir)]) == [".bcmesh", ".bcs"])
+
+    def testBinary(self):
+        code = batch.main(["-o", self.dirname, "-f", "bcs", os.path.join(DATA, "hole.stl")])
+        self.assert_(code == 0)
+        reader = BinarySliceReader(os.path.join(self.dirname, "hole.bcs"))
+        self.assert_(len(reader) == 10)
+        reader.close()
+
 if __name__ == '__main__':
     unittest.main()